@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import cache
+import makers
+import pack
+import scanner
+import scents
+
+aparser = argparse.ArgumentParser(description='Time the SOTD scanner against saved data')
+aparser.add_argument('benchmark', choices=['search', 'scents', 'import', 'workers', 'load', 'startup',
+        'compress', 'fetch'],
+        help='Specify the benchmark; maker search over comment bodies,\n'
+        'scent-first matching over comment lines, module import time,\n'
+        'a compile with 1 to --workers processes, loading comment records,\n'
+        'the imports made by a compile of the --glob files, the size and\n'
+        'reading speed of the cache file formats, or an incremental update\n'
+        'with 1 to --workers fetchers from replay.py serving postdata.')
+aparser.add_argument('--glob', default='202*.json',
+        help='Specify which files in postdata to use (default "202*.json").')
+aparser.add_argument('--repeat', type=int, default=3,
+        help='Specify how many times to repeat each timing; the best is reported.')
+aparser.add_argument('--month', metavar='yyyy-mm',
+        help='Specify the month to compile for the workers and startup benchmarks.')
+aparser.add_argument('--workers', type=int, default=os.cpu_count(),
+        help='Specify the most worker processes or fetchers to time (default is the CPU count).')
+aparser.add_argument('--latency', type=float, default=0.1,
+        help='Specify the seconds replay.py holds back each response, for the fetch benchmark.')
+args = aparser.parse_args()
+
+data_dir = Path('postdata')
+
+
+def load_comments( ):
+    """ Returns the list of comment dicts in the selected saved data files.
+    """
+    if not data_dir.is_dir():
+        raise SystemExit('No postdata directory!  I cannot find saved data.')
+    comments = [ ]
+    for name in sorted(data_dir.glob(args.glob)):
+        with open(file=name, mode='r', encoding='utf8') as cmt_file:
+            comments += json.load(cmt_file).get('comments')
+    if not comments:
+        raise SystemExit(f"No comments found in postdata/{args.glob}")
+    return comments
+
+
+def best_time( func, *func_args ):
+    """ Runs the function args.repeat times, returning the best time in seconds.
+    """
+    best = None
+    for i in range(args.repeat):
+        start = time.perf_counter()
+        func(*func_args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_search( ):
+    bodies = [ cmt['body'] for cmt in load_comments() ]
+    makers._compile()
+
+    def run( prefilter ):
+        for body in bodies:
+            makers.searchMaker(body, prefilter)
+
+    all_time = best_time(run, False)
+    pre_time = best_time(run, True)
+    print(f"searchMaker over {len(bodies)} comments:")
+    print(f"  all patterns: {len(bodies) / all_time:10.1f} comments/sec")
+    print(f"  prefiltered:  {len(bodies) / pre_time:10.1f} comments/sec ({all_time / pre_time:.2f}x)")
+
+
+
+def bench_scents( ):
+    # the lather text scanner.scanBody() finds, and the lines
+    # scanner.scentFirst() would try
+    lathers = [ ]
+    lines = [ ]
+    for cmt in load_comments():
+        lmr = scanner.lather_pattern.search(cmt['body'])
+        if lmr:
+            lathers.append(lmr.group(1).strip())
+        lines += [ line.strip() for line in cmt['body'].split('\n') if line.strip() ]
+    scents._compile_all()
+
+    def run( texts, prefilter ):
+        for text in texts:
+            scents.findAnyScent(text, prefilter)
+
+    for texts, label in ( ( lathers, 'lather texts' ), ( lines, 'lines' ) ):
+        all_time = best_time(run, texts, False)
+        pre_time = best_time(run, texts, True)
+        print(f"findAnyScent over {len(texts)} {label}:")
+        print(f"  all makers: {len(texts) / all_time:10.1f} per sec")
+        print(f"  indexed:    {len(texts) / pre_time:10.1f} per sec ({all_time / pre_time:.2f}x)")
+
+
+# each is timed in a fresh interpreter, after the setup code
+import_timings = [
+    ( 'import scents', '', 'import scents' ),
+    ( 'import makers', '', 'import makers' ),
+    ( 'import scanner', '', 'import scanner' ),
+    ( 'makers._compile()', 'import makers', 'makers._compile()' ),
+    ( 'scents.match_scent()', 'import scents', "scents.match_scent('Barrister and Mann', 'Seville')" ),
+    ( 'scents.findAnyScent()', 'import scents', "scents.findAnyScent('Seville')" ),
+]
+
+def bench_import( ):
+    # one line per timing, for tracking from run to run
+    for label, setup, statement in import_timings:
+        code = (f"import time\n{setup}\nstart = time.perf_counter()\n{statement}\n"
+                "print(time.perf_counter() - start)")
+        times = [ ]
+        for i in range(args.repeat):
+            result = subprocess.run([ sys.executable, '-c', code ], capture_output=True,
+                    text=True, check=True, cwd=Path(__file__).parent)
+            times.append(float(result.stdout))
+        print(f"{label:24} {statistics.median(times) * 1000:8.1f} ms")
+
+
+def bench_workers( ):
+    if not args.month:
+        raise SystemExit('Specify the month to compile with --month.')
+    if not data_dir.is_dir():
+        raise SystemExit('No postdata directory!  I cannot find saved data.')
+    main_py = Path(__file__).parent / 'main.py'
+    serial = None
+    # compile in a scratch directory, so any real output is left alone
+    with tempfile.TemporaryDirectory() as work_dir:
+        (Path(work_dir) / 'postdata').symlink_to(data_dir.resolve())
+        output = Path(work_dir) / f"sotd-{args.month}.csv"
+        for workers in range(1, args.workers + 1):
+            command = [ sys.executable, str(main_py), 'compile', '--month', args.month,
+                    '--delimiter', 'tab', '--no-memo', '--workers', str(workers) ]
+            best = None
+            for i in range(args.repeat):
+                start = time.perf_counter()
+                subprocess.run(command, capture_output=True, check=True, cwd=work_dir)
+                elapsed = time.perf_counter() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            rows = output.read_bytes()
+            if serial is None:
+                serial = best
+                serial_rows = rows
+            print(f"{workers:3} workers {best:8.2f} s ({serial / best:.2f}x)"
+                    + ('' if rows == serial_rows else '  OUTPUT DIFFERS'))
+
+
+def bench_load( ):
+    comments = load_comments()
+    loaders = [ ( 'cache.CachedComment', cache.CachedComment ) ]
+    try:
+        import praw
+        def praw_comment( data ):
+            # as main.py used to load the cache
+            data = dict(data)
+            if not data['author']:
+                data['author'] = '[deleted]'
+            return praw.reddit.models.Comment(reddit='Reddit', _data=data)
+        loaders.append(( 'praw Comment', praw_comment ))
+    except ImportError:
+        print('praw is not installed; timing comment records only.')
+
+    def run( loader ):
+        return [ loader(cmt) for cmt in comments ]
+
+    print(f"Loading {len(comments)} comments:")
+    for label, loader in loaders:
+        load_time = best_time(run, loader)
+        tracemalloc.start()
+        records = run(loader)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del records
+        print(f"  {label:20} {load_time * 1000:8.1f} ms {size / 1024:10.1f} KiB")
+
+    # reading the cache files, against the packed corpus
+    names = sorted(data_dir.glob(args.glob))
+
+    def read_files( ):
+        for name in names:
+            with open(file=name, mode='r', encoding='utf8') as cmt_file:
+                for cmt in json.load(cmt_file).get('comments'):
+                    cache.CachedComment(cmt)
+
+    read_time = best_time(read_files)
+    print(f"Reading {len(names)} cache files: {read_time * 1000:8.1f} ms")
+    if Path(pack.pack_filename).exists():
+        corpus = pack.PackedCorpus(pack.pack_filename)
+
+        def read_pack( ):
+            for cmt in corpus.iter_all():
+                pass
+
+        pack_time = best_time(read_pack)
+        print(f"Reading all {corpus.comment_count} comments in {pack.pack_filename}: {pack_time * 1000:8.1f} ms"
+                f" ({read_time / pack_time * corpus.comment_count / len(comments):.2f}x per comment)")
+
+
+def bench_startup( ):
+    if not args.month:
+        raise SystemExit('Specify the month to compile with --month.')
+    if not data_dir.is_dir():
+        raise SystemExit('No postdata directory!  I cannot find saved data.')
+    main_py = Path(__file__).parent / 'main.py'
+    with tempfile.TemporaryDirectory() as work_dir:
+        # a small cache: only the selected files
+        (Path(work_dir) / 'postdata').mkdir()
+        for name in sorted(data_dir.glob(args.glob)):
+            (Path(work_dir) / 'postdata' / name.name).symlink_to(name.resolve())
+        command = [ sys.executable, '-X', 'importtime', str(main_py), 'compile', '--month', args.month,
+                '--delimiter', 'tab', '--no-memo' ]
+        start = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True, check=True, cwd=work_dir)
+        elapsed = time.perf_counter() - start
+    # lines are "import time: self [us] | cumulative | imported package"
+    imports = [ ]
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and line.startswith('import time:') and fields[1].strip().isdigit():
+            imports.append(( int(fields[1]), fields[2].rstrip() ))
+    top_level = [ ( cumulative, name ) for cumulative, name in imports if not name.startswith('  ') ]
+    print(f"main.py compile: {elapsed * 1000:.1f} ms total, {len(imports)} modules imported,"
+            f" {sum(cumulative for cumulative, name in top_level) / 1000:.1f} ms importing")
+    for cumulative, name in sorted(top_level, reverse=True)[0:10]:
+        print(f"  {cumulative / 1000:8.1f} ms {name.strip()}")
+    if any(name.strip() == 'praw' for cumulative, name in imports):
+        print('  praw was imported!')
+
+
+def bench_compress( ):
+    if not data_dir.is_dir():
+        raise SystemExit('No postdata directory!  I cannot find saved data.')
+    posts = [ ]
+    for name in sorted(data_dir.glob(args.glob)):
+        with open(file=name, mode='r', encoding='utf8') as cmt_file:
+            posts.append(( name.stem, [ cache.CachedComment(cmt) for cmt in json.load(cmt_file).get('comments') ] ))
+    comment_count = sum(len(comments) for stem, comments in posts)
+    if not comment_count:
+        raise SystemExit(f"No comments found in postdata/{args.glob}")
+    print(f"{len(posts)} files, {comment_count} comments:")
+    plain_size = None
+    with tempfile.TemporaryDirectory() as work_dir:
+        for format in ( 'json', 'jsonl', 'jsonl.gz', 'jsonl.xz' ):
+            names = [ str(Path(work_dir) / f"{stem}.{format}") for stem, comments in posts ]
+
+            def write( ):
+                for name, ( stem, comments ) in zip(names, posts):
+                    cache._write_file(name, cache._file_lines(comments, format.partition('.')[0]))
+
+            def read( ):
+                for name in names:
+                    for cmt in cache._read_comments(name):
+                        cache.CachedComment(cmt)
+
+            write_time = best_time(write)
+            read_time = best_time(read)
+            size = sum(Path(name).stat().st_size for name in names)
+            if plain_size is None:
+                plain_size = size
+            print(f"  {format:9} {size / 1024:10.1f} KiB ({size / plain_size:6.1%})"
+                    f"  write {write_time * 1000:8.1f} ms"
+                    f"  read {comment_count / read_time:10.1f} comments/sec")
+
+
+def bench_fetch( ):
+    if not data_dir.is_dir():
+        raise SystemExit('No postdata directory!  I cannot find saved data.')
+    if importlib.util.find_spec('praw') is None:
+        raise SystemExit('praw is not installed; it is needed to fetch from replay.py.')
+    package = Path(__file__).parent
+    port = '8765'
+    # a limit high enough that praw does not space the requests out
+    server = subprocess.Popen([ sys.executable, str(package / 'replay.py'), '--port', port,
+            '--latency', str(args.latency), '--limit', '1000000', '--days-ago', '1' ],
+            stdout=subprocess.PIPE, text=True)
+    try:
+        print(server.stdout.readline(), end='')
+        for fetchers in range(1, args.workers + 1):
+            # every post served, however far back
+            command = [ sys.executable, str(package / 'main.py'), 'incremental', '--days', '3650',
+                    '--reddit-url', f"http://127.0.0.1:{port}", '--rate', '1000000', '--fetchers', str(fetchers) ]
+            with tempfile.TemporaryDirectory() as work_dir:
+                # the first run saves every post; the second finds them all unchanged
+                times = [ ]
+                for i in range(2):
+                    start = time.perf_counter()
+                    result = subprocess.run(command, capture_output=True, text=True, check=True, cwd=work_dir)
+                    times.append(time.perf_counter() - start)
+            print(f"{fetchers:3} fetchers {times[0]:8.2f} s new, {times[1]:8.2f} s unchanged:"
+                    f" {result.stdout.splitlines()[-1]}")
+    finally:
+        server.terminate()
+        print(server.communicate()[0], end='')
+
+
+if args.benchmark == 'search':
+    bench_search()
+elif args.benchmark == 'scents':
+    bench_scents()
+elif args.benchmark == 'import':
+    bench_import()
+elif args.benchmark == 'workers':
+    bench_workers()
+elif args.benchmark == 'load':
+    bench_load()
+elif args.benchmark == 'startup':
+    bench_startup()
+elif args.benchmark == 'compress':
+    bench_compress()
+elif args.benchmark == 'fetch':
+    bench_fetch()
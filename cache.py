@@ -0,0 +1,881 @@
+#!/usr/bin/env python3
+
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import re
+import sqlite3
+from datetime import date
+from pathlib import Path
+
+
+class Author:
+    """ The author of a cached comment; like a praw Redditor, str() is the name.
+    """
+    __slots__ = ( 'name', )
+
+    def __init__( self, name: str ):
+        self.name = name
+
+    def __str__( self ):
+        return self.name
+
+
+class CachedComment:
+    """ A comment loaded from the file cache.  It has the attributes of a praw
+        Comment that the scanner and the cache use, without the cost of
+        building praw objects.  As with praw, a deleted author is None.
+    """
+    __slots__ = ( 'id', 'author', 'body', 'body_html', 'created_utc', 'edited', 'link_id',
+            'parent_id', 'permalink', 'saved', 'score', 'subreddit_id' )
+
+    def __init__( self, data: dict ):
+        self.id = data['id']
+        self.author = _author(data.get('author'))
+        self.body = data['body']
+        self.body_html = data['body_html']
+        self.created_utc = data['created_utc']
+        self.edited = data.get('edited', False)
+        self.link_id = data.get('link_id')
+        self.parent_id = data.get('parent_id')
+        self.permalink = data['permalink']
+        self.saved = data.get('saved', False)
+        self.score = data.get('score')
+        self.subreddit_id = data.get('subreddit_id')
+
+
+class CacheFileError(Exception):
+    """ Raised by iter_cached_comments() when a cache file cannot be read to
+        the end, after the comments before the damage have been yielded.
+    """
+
+
+# most authors post every day, so they share one Author each
+_authors = { }
+
+def _author( name: str ):
+    if not name or name == '[deleted]':
+        return None
+    author = _authors.get(name)
+    if author is None:
+        author = _authors[name] = Author(name)
+    return author
+
+
+# the format save_comments_to_cache() writes: 'json' for one JSON document
+# with a comment per line, 'jsonl' for just the comment lines, 'log' for an
+# append log of numbered comment records, 'jsonl.gz' or 'jsonl.xz' for comment
+# lines compressed with gzip or lzma, or 'sqlite' for the comment store, which
+# is then the only place comments are read from
+cache_format = 'json'
+store_filename = 'sotd.db'
+# the formats kept in postdata, in the order get_cached_comments() looks
+file_formats = ( 'log', 'jsonl', 'json', 'jsonl.gz', 'jsonl.xz' )
+# the modules for the compressed formats' last suffix
+_compressions = { 'gz': gzip, 'xz': lzma }
+# an append log is rewritten once the records replaced by later ones would
+# be more than this share of its comments
+log_slack = 0.5
+
+def cache_filename( post_id: str, post_date: date, format: str ):
+    # note get_cached_comments() and save_comments_to_cache() both rely on this
+    return f"postdata/{post_date.strftime('%Y-%m-%d')}-{post_id}.{format}"
+
+
+def _file_format( name: str ):
+    # post IDs have no dots, so the format is everything after the first
+    return name.partition('.')[2]
+
+
+# names of the files cache_filename() gives
+cache_file_pattern = re.compile('^(\\d{4})-(\\d\\d)-(\\d\\d)-(\\w+)\\.(?:jsonl?|log|jsonl\\.gz|jsonl\\.xz)$')
+# kept beside postdata, so writing them leaves the directory unchanged
+manifest_filename = 'postdata-manifest.json'
+index_filename = 'postdata-index.db'
+
+
+def _comment_offsets( data: bytes, format: str ):
+    """ Returns ( byte offset, comment dict ) for each comment in the contents
+        of a cache file.  The offset is None if comments are not one per line.
+        For an append log, only the latest record of each comment is returned,
+        in the place of its first.
+    """
+    format, dot, compression = format.partition('.')
+    if compression:
+        data = _compressions[compression].decompress(data)
+        return [ ( None, cmt ) for offset, cmt in _comment_offsets(data, format) ]
+    lines = data.splitlines(keepends = True)
+    if format == 'json' and (not lines or lines[0].strip() != b'{"comments": ['):
+        return [ ( None, cmt ) for cmt in json.loads(data).get('comments') ]
+    if format != 'json' and lines and not lines[-1].endswith(b'\n'):
+        # the end of a run killed while appending
+        lines.pop()
+    comments = { }
+    offset = 0
+    for line in lines:
+        start = offset
+        offset += len(line)
+        text = line.strip().rstrip(b',')
+        if not text or (format == 'json' and (start == 0 or text == b']}')):
+            continue
+        cmt = json.loads(text)
+        if format == 'log':
+            cmt = cmt['comment']
+        comments[cmt['id']] = ( start, cmt )
+    return list(comments.values())
+
+
+class CommentIndex:
+    """ Finds cached comments by ID, author or post date without reading the
+        whole cache, by keeping the file and byte offset of each comment.  The
+        Manifest keeps it up to date as files are written or found changed.
+    """
+
+    def __init__( self, filename: str = index_filename ):
+        self.db = sqlite3.connect(filename)
+        self.db.executescript('''
+            create table if not exists comment_index (
+                comment_id text not null
+                , file text not null
+                , offset int
+                , author text not null
+                , post_date text not null
+                , primary key (comment_id, file)
+                );
+            create index if not exists comment_index_file on comment_index (file);
+            create index if not exists comment_index_author on comment_index (author collate nocase);
+            create index if not exists comment_index_post_date on comment_index (post_date);
+            ''')
+
+
+    def is_empty( self ):
+        return self.db.execute('select 1 from comment_index limit 1').fetchone() is None
+
+
+    def set_file( self, name: str, post_date: str, comments: list ):
+        """ Replaces the entries for the named file with the given
+            ( offset, comment dict ) list.
+        """
+        self.remove_file(name)
+        self.add_comments(name, post_date, comments)
+
+
+    def add_comments( self, name: str, post_date: str, comments: list ):
+        """ Adds entries for the named file from the given ( offset, comment
+            dict ) list, replacing any for the same comments.  Returns how many
+            of the comments were not there before.
+        """
+        added = 0
+        for offset, cmt in comments:
+            if self.db.execute('select 1 from comment_index where comment_id = ? and file = ?',
+                    ( cmt['id'], name )).fetchone() is None:
+                added += 1
+        self.db.executemany('insert or replace into comment_index values (?, ?, ?, ?, ?)',
+                [ ( cmt['id'], name, offset, cmt['author'] or '[deleted]', post_date )
+                for offset, cmt in comments ])
+        return added
+
+
+    def remove_file( self, name: str ):
+        self.db.execute('delete from comment_index where file = ?', ( name, ))
+
+
+    def file_names( self ):
+        """ Returns the set of file names with entries.
+        """
+        return set(row[0] for row in self.db.execute('select distinct file from comment_index'))
+
+
+    def find( self, author: str = None, ids: list = None, post_date: date = None ):
+        """ Returns ( file, offset, comment ID ) for each comment matching all the
+            given conditions: the author (any case, '[deleted]' for none), any of
+            the IDs, and the post date.
+        """
+        where = [ ]
+        params = [ ]
+        if author:
+            where.append('author = ? collate nocase')
+            params.append(author)
+        if ids:
+            where.append('comment_id in (' + ', '.join('?' * len(ids)) + ')')
+            params += ids
+        if post_date:
+            where.append('post_date = ?')
+            params.append(post_date.isoformat())
+        query = 'select file, offset, comment_id from comment_index'
+        if where:
+            query += ' where ' + ' and '.join(where)
+        return self.db.execute(query + ' order by file, offset', params).fetchall()
+
+
+    def commit( self ):
+        self.db.commit()
+
+
+def read_comment( path: Path, offset: int, comment_id: str ):
+    """ Reads one comment from a cache file, at the offset given by the index.
+        Returns None if the comment is not found there, or the file is gone.
+    """
+    try:
+        if offset is None:
+            for offset, cmt in _comment_offsets(path.read_bytes(), _file_format(path.name)):
+                if cmt['id'] == comment_id:
+                    return CachedComment(cmt)
+            return None
+        with open(file = path, mode = 'rb') as cache_file:
+            cache_file.seek(offset)
+            cmt = json.loads(cache_file.readline().strip().rstrip(b','))
+    except FileNotFoundError:
+        return None
+    if _file_format(path.name) == 'log':
+        cmt = cmt['comment']
+    return CachedComment(cmt)
+
+
+class Manifest:
+    """ An index of the file cache.  For each file it keeps the post ID and date,
+        comment count, size, modification time and SHA-1 checksum; for each
+        month, the files with its posts; and its comments in a CommentIndex.
+        save_comments_to_cache() keeps it up to date, and files changed any
+        other way are found by refresh(), or by month_files() for the month
+        asked for.
+    """
+
+    def __init__( self, filename: str = manifest_filename, directory: str = 'postdata' ):
+        self.filename = filename
+        self.directory = Path(directory)
+        self.files = { }
+        self.months = { }
+        self.dir_mtime = 0
+        self.changed = False
+        if Path(filename).exists():
+            with open(file = filename, mode = 'r', encoding = 'utf8') as manifest_file:
+                data = json.load(manifest_file)
+            self.files = data['files']
+            self.months = data['months']
+            self.dir_mtime = data['dir_mtime']
+        self.index = CommentIndex(str(Path(filename).parent / index_filename))
+        if self.files and self.index.is_empty():
+            # the index is new; have refresh() read every file
+            self.files = { }
+            self.months = { }
+            self.dir_mtime = 0
+
+
+    def update( self, name: str ):
+        """ Records the current state of the named cache file.
+        """
+        path = self.directory / name
+        result = cache_file_pattern.match(name)
+        post_date = f"{result.group(1)}-{result.group(2)}-{result.group(3)}"
+        stat = path.stat()
+        data = path.read_bytes()
+        try:
+            comments = _comment_offsets(data, _file_format(name))
+            count = len(comments)
+        except Exception:
+            comments = [ ]
+            count = None
+        self.remove(name)
+        self.files[name] = { 'post_id': result.group(4), 'post_date': post_date,
+                'comments': count, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                'checksum': hashlib.sha1(data).hexdigest() }
+        self.index.set_file(name, post_date, comments)
+        month = f"{result.group(1)}-{result.group(2)}"
+        self.months.setdefault(month, [ ]).append(name)
+        self.months[month].sort()
+        self.changed = True
+
+
+    def extend( self, name: str ):
+        """ Records lines appended to the named jsonl file or append log since
+            it was last recorded, reading only those.  Its checksum is then not
+            known until the file is next read whole, and is left as None.
+        """
+        entry = self.files[name]
+        path = self.directory / name
+        with open(file = path, mode = 'rb') as cache_file:
+            cache_file.seek(entry['size'])
+            data = cache_file.read()
+        comments = [ ( entry['size'] + offset, cmt )
+                for offset, cmt in _comment_offsets(data, _file_format(name)) ]
+        added = self.index.add_comments(name, entry['post_date'], comments)
+        stat = path.stat()
+        if entry['comments'] is not None:
+            entry['comments'] += added
+        entry.update({ 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'checksum': None })
+        self.changed = True
+
+
+    def remove( self, name: str ):
+        self.index.remove_file(name)
+        entry = self.files.pop(name, None)
+        if entry:
+            month = entry['post_date'][0:7]
+            self.months[month].remove(name)
+            if not self.months[month]:
+                del self.months[month]
+            self.changed = True
+
+
+    def _stale( self, name: str ):
+        """ Returns True if the named file is not as recorded, or is gone.
+        """
+        entry = self.files.get(name)
+        try:
+            stat = (self.directory / name).stat()
+        except FileNotFoundError:
+            return True
+        return not entry or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns
+
+
+    def _changed( self, name: str ):
+        """ Returns True if the named file may not be as recorded, or is gone.
+            A file whose size and mtime are not as recorded, but whose contents
+            still have the recorded checksum, is unchanged; its new mtime is
+            recorded.
+        """
+        if not self._stale(name):
+            return False
+        entry = self.files.get(name)
+        path = self.directory / name
+        try:
+            stat = path.stat()
+            if (not entry or not entry['checksum'] or entry['size'] != stat.st_size
+                    or hashlib.sha1(path.read_bytes()).hexdigest() != entry['checksum']):
+                return True
+        except FileNotFoundError:
+            return True
+        entry['mtime'] = stat.st_mtime_ns
+        self.changed = True
+        return False
+
+
+    def in_sync( self ):
+        """ Returns True if no files have been added or removed since the
+            directory was last listed.
+        """
+        return self.directory.is_dir() and self.directory.stat().st_mtime_ns == self.dir_mtime
+
+
+    def refresh( self, check_files: bool = True ):
+        """ Picks up files added or removed since the manifest was saved, when
+            the directory has changed, and with check_files, files changed in
+            place, which leave the directory as it was.
+        """
+        if not self.directory.is_dir():
+            return
+        if not self.in_sync():
+            dir_mtime = self.directory.stat().st_mtime_ns
+            names = set(entry.name for entry in os.scandir(self.directory)
+                    if cache_file_pattern.match(entry.name))
+            for name in list(self.files):
+                if name not in names:
+                    self.remove(name)
+            # entries for files the manifest lost track of, such as those of a
+            # manifest deleted or saved before a crash
+            for name in self.index.file_names() - names:
+                self.index.remove_file(name)
+            for name in names:
+                if self._changed(name):
+                    self.update(name)
+            self.dir_mtime = dir_mtime
+            self.changed = True
+        elif check_files:
+            for name in list(self.files):
+                if not (self.directory / name).exists():
+                    self.remove(name)
+                elif self._changed(name):
+                    self.update(name)
+
+
+    def month_files( self, year: int, month: int ):
+        """ Returns the names of the month's files, updating any that changed.
+        """
+        names = self.months.get(f"{year:0>4}-{month:0>2}", [ ])
+        for name in list(names):
+            if not (self.directory / name).exists():
+                self.remove(name)
+            elif self._changed(name):
+                self.update(name)
+        return list(self.months.get(f"{year:0>4}-{month:0>2}", [ ]))
+
+
+    def save( self ):
+        self.index.commit()
+        if not self.changed:
+            return
+        # write a new file and rename it, so a crash never leaves half a manifest
+        temp_name = self.filename + '.tmp'
+        with open(file = temp_name, mode = 'w', encoding = 'utf8') as manifest_file:
+            json.dump({ 'files': self.files, 'months': self.months, 'dir_mtime': self.dir_mtime },
+                    manifest_file)
+        os.replace(temp_name, self.filename)
+        self.changed = False
+
+
+def load_manifest( check_files: bool = True ):
+    """ Returns the file cache manifest, brought up to date with the directory;
+        see Manifest.refresh().
+    """
+    manifest = Manifest()
+    manifest.refresh(check_files)
+    manifest.save()
+    return manifest
+
+
+def _find_cache_file( post_id: str, post_date: date ):
+    for format in file_formats:
+        filename = cache_filename(post_id, post_date, format)
+        if Path(filename).exists():
+            return filename
+    return None
+
+
+def _open_cache( filename: str, mode: str ):
+    """ Opens a cache file in text mode, through gzip or lzma if it is compressed.
+    """
+    module = _compressions.get(filename.rpartition('.')[2])
+    if module:
+        return module.open(filename, mode + 't', encoding = 'utf8')
+    return open(file = filename, mode = mode, encoding = 'utf8')
+
+
+def _read_comments( filename: str ):
+    """ Yields the comment dicts in a cache file, one line at a time, so even a
+        compressed file is decompressed as it is read.  An incomplete last
+        line, left by a run killed while appending, is skipped.
+    """
+    format = _file_format(Path(filename).name).partition('.')[0]
+    with _open_cache(filename, 'r') as comments_file:
+        if format == 'log':
+            # a comment's latest record replaces the earlier ones, in place
+            comments = { }
+            for line in comments_file:
+                if line.strip() and line.endswith('\n'):
+                    record = json.loads(line)
+                    comments[record['comment']['id']] = record['comment']
+            yield from comments.values()
+            return
+        if format == 'jsonl':
+            for line in comments_file:
+                if line.strip() and line.endswith('\n'):
+                    yield json.loads(line)
+            return
+        if comments_file.readline().strip() != '{"comments": [':
+            # not as save_comments_to_cache() writes it; read it whole
+            comments_file.seek(0)
+            yield from json.load(comments_file).get('comments')
+            return
+        for line in comments_file:
+            line = line.rstrip().rstrip(',')
+            if line and line != ']}':
+                yield json.loads(line)
+
+
+def iter_cached_comments( post_id: str, post_date: date ):
+    """ Yields the comments for the given post ID and date from the cache, one
+        at a time, so scanning can start before the file is read.  Nothing is
+        yielded if the post is not in the cache; if the file is damaged, an
+        error is printed and CacheFileError raised after the comments before
+        the damage.
+    """
+    if cache_format == 'sqlite':
+        yield from comment_store().iter_comments(post_id, post_date)
+        return
+    filename = _find_cache_file(post_id, post_date)
+    if filename:
+        try:
+            for cmt in _read_comments(filename):
+                yield CachedComment(cmt)
+        except Exception as e:
+            print(f"Error loading cache file {filename}: {e}")
+            raise CacheFileError(filename) from e
+
+
+def get_cached_comments( post_id: str, post_date: date ):
+    """ If the given post ID with the given date is found in the cache, the
+        list of comments is returned.  Otherwise None is returned.
+    """
+    if cache_format == 'sqlite':
+        return comment_store().get_comments(post_id, post_date)
+    filename = _find_cache_file(post_id, post_date)
+    if filename:
+        try:
+            return [ CachedComment(cmt) for cmt in _read_comments(filename) ]
+        except Exception as e:
+            print(f"Error loading cache file {filename}: {e}")
+    return None
+
+
+def save_comments_to_cache( post_id: str, post_date: date, comments, appended: list = None,
+        edited: list = None ):
+    """ Saves the given collection of comments to the file cache.  This will
+        overwrite any existing cache for the post.  If appended is given, it
+        lists the comments at the end of the collection which are new since
+        the post was last saved, and edited lists those replaced in it; the
+        rest are unchanged.  Then only those are written, when the saved post
+        allows it: an append log takes both, the other formats only new ones.
+        Files are never left half written: they are written in full under a
+        temporary name and renamed, or appended to and synced.
+    """
+    edited = edited or [ ]
+    if cache_format == 'sqlite':
+        if appended is not None and not edited:
+            comment_store().save_comments(post_id, post_date, appended, replace = False)
+        else:
+            comment_store().save_comments(post_id, post_date, comments)
+        return
+    filename = cache_filename(post_id, post_date, cache_format)
+    name = Path(filename).name
+    Path('postdata').mkdir(exist_ok = True)
+    manifest = _kept_manifest or Manifest()
+    in_sync = manifest.in_sync()
+    recorded = name in manifest.files and not manifest._stale(name)
+    if appended is not None and _append_comments(filename, comments, appended, edited):
+        if recorded and cache_format in ( 'jsonl', 'log' ):
+            manifest.extend(name)
+        else:
+            manifest.update(name)
+    else:
+        # a copy in another format would be read instead, or as well
+        for format in file_formats:
+            if format != cache_format:
+                Path(cache_filename(post_id, post_date, format)).unlink(missing_ok = True)
+                manifest.remove(Path(cache_filename(post_id, post_date, format)).name)
+        _write_file(filename, _file_lines(comments, cache_format.partition('.')[0]))
+        manifest.update(name)
+    if in_sync:
+        # the only change to the directory was this post's files
+        manifest.dir_mtime = manifest.directory.stat().st_mtime_ns
+    if manifest is not _kept_manifest:
+        manifest.save()
+
+
+# the Manifest save_comments_to_cache() updates while keep_manifest() holds
+# it open; otherwise each save opens and writes the manifest itself
+_kept_manifest = None
+
+def keep_manifest( ):
+    """ Keeps one Manifest open for the saves which follow, as in a run
+        saving many posts or comments, so each updates it in memory rather
+        than loading and writing it.  save_manifest() writes it.
+    """
+    global _kept_manifest
+    if _kept_manifest is None and cache_format != 'sqlite':
+        _kept_manifest = Manifest()
+
+
+def save_manifest( release: bool = False ):
+    """ Writes the manifest keep_manifest() holds open, if there is one, and
+        with release, stops holding it.
+    """
+    global _kept_manifest
+    if _kept_manifest is not None:
+        _kept_manifest.save()
+        if release:
+            _kept_manifest.index.db.close()
+            _kept_manifest = None
+
+
+def _file_lines( comments, format: str ):
+    """ Yields the contents of a cache file in the given format, a comment at
+        a time, as UTF-8.
+    """
+    if format == 'json':
+        yield b'{"comments": [\n'
+    seq = 0
+    for tlc in comments:
+        seq += 1
+        map = _comment_map(tlc)
+        if format == 'log':
+            yield (json.dumps({ 'seq': seq, 'comment': map }) + '\n').encode('utf8')
+        elif format == 'jsonl':
+            yield (json.dumps(map) + '\n').encode('utf8')
+        else:
+            yield ((',\n' if seq > 1 else '') + json.dumps(map)).encode('utf8')
+    if format == 'json':
+        yield b'\n]}'
+
+
+def _write_file( filename: str, chunks ):
+    """ Writes the chunks of bytes to a temporary file, compressing them as
+        they go if the name says to, then renames it over the named one, so a
+        run killed part way through leaves the old file.
+    """
+    temp_name = filename + '.tmp'
+    compression = filename.rpartition('.')[2]
+    with open(file = temp_name, mode = 'wb') as temp_file:
+        if compression == 'gz':
+            # no timestamp, so unchanged comments give an unchanged file
+            out = gzip.GzipFile(filename = '', mode = 'wb', fileobj = temp_file, mtime = 0)
+        elif compression == 'xz':
+            out = lzma.LZMAFile(temp_file, mode = 'wb')
+        else:
+            out = temp_file
+        for chunk in chunks:
+            out.write(chunk)
+        if out is not temp_file:
+            out.close()
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_name, filename)
+
+
+def _tail( cache_file, end: int ):
+    """ Returns the offset just after the last newline before end in the open
+        file, and the complete line which ends there (b'' if there is none).
+    """
+    data = b''
+    start = end
+    while start > 0:
+        step = min(4096, start)
+        start -= step
+        cache_file.seek(start)
+        data = cache_file.read(step) + data
+        last = data.rfind(b'\n')
+        if last >= 0:
+            previous = data.rfind(b'\n', 0, last)
+            if previous >= 0 or start == 0:
+                return start + last + 1, data[previous + 1:last + 1]
+    return 0, b''
+
+
+def _append_lines( path: Path, make_lines ):
+    """ Appends to a jsonl file or append log, after dropping any incomplete
+        line a killed run left at the end, and syncs the file.  make_lines()
+        is given the last complete line, and returns the lines to append, or
+        None to leave the file alone; then False is returned.
+    """
+    with open(file = path, mode = 'r+b') as cache_file:
+        end, last = _tail(cache_file, cache_file.seek(0, os.SEEK_END))
+        lines = make_lines(last)
+        if lines is None:
+            return False
+        cache_file.truncate(end)
+        cache_file.seek(end)
+        cache_file.write(''.join(lines).encode('utf8'))
+        cache_file.flush()
+        os.fsync(cache_file.fileno())
+    return True
+
+
+def _append_comments( filename: str, comments: list, appended: list, edited: list ):
+    """ Writes just the new and edited comments to a cache file, as described
+        for save_comments_to_cache().  Returns False, leaving the file alone,
+        if the file is missing or not as expected, if it cannot take edits,
+        if it is compressed, or if it is an append log due to be compacted.
+    """
+    path = Path(filename)
+    if not path.exists() or filename.rpartition('.')[2] in _compressions:
+        return False
+    if filename.endswith('.log'):
+        changed = appended + edited
+
+        def records( last: bytes ):
+            seq = json.loads(last)['seq'] if last.strip() else 0
+            if seq + len(changed) - len(comments) > len(comments) * log_slack:
+                # rewriting it drops the replaced records and numbers it afresh
+                return None
+            return [ json.dumps({ 'seq': seq + i + 1, 'comment': _comment_map(changed[i]) }) + '\n'
+                    for i in range(len(changed)) ]
+
+        return _append_lines(path, records)
+    if edited:
+        return False
+    lines = [ json.dumps(_comment_map(tlc)) for tlc in appended ]
+    if filename.endswith('.jsonl'):
+        return _append_lines(path, lambda last: [ line + '\n' for line in lines ])
+    # copy the file up to its closing "\n]}" after the last comment, then add
+    # the new comments, rather than writing over the end in place
+    data = path.read_bytes()
+    if not data.endswith(b'}\n]}'):
+        return False
+    _write_file(filename, [ data[:-3], (''.join(',\n' + line for line in lines) + '\n]}').encode('utf8') ])
+    return True
+
+
+def _comment_map( tlc ):
+    """ Returns the dict saved in the cache for a comment.
+    """
+    author_name = None
+    if tlc.author:
+        author_name = tlc.author.name
+    # apparently created_utc is actually created CST?
+    # at least for me it is, and for other posts the conversion is
+    # the same from web -> created_utc
+    # edited appears to work the same despite not being named _utc
+    map = {
+        'author': author_name,
+        'id': tlc.id,
+        'body': tlc.body,
+        'body_html': tlc.body_html,
+        'created_utc': tlc.created_utc,
+        'edited': tlc.edited,
+        'link_id': tlc.link_id,
+        'parent_id': tlc.parent_id,
+        'permalink': tlc.permalink,
+        'saved': tlc.saved,
+        'score': tlc.score,
+        'subreddit_id': tlc.subreddit_id
+    }
+    if tlc.edited:
+        map['edited'] = tlc.edited
+    return map
+
+
+_store = None
+_store_pid = None
+
+def comment_store( ):
+    """ Returns the CommentStore for store_filename, opening it on first use.
+        A forked process opens its own connection.
+    """
+    global _store, _store_pid
+    if _store is None or _store_pid != os.getpid():
+        _store = CommentStore(store_filename)
+        _store_pid = os.getpid()
+    return _store
+
+
+# columns read for each comment, in the order _row_comment() expects
+_comment_columns = '''c.comment_id, c.author_name, p.full_text, h.full_text, c.created_time,
+        c.edited_time, c.link_id, c.parent_id, c.permalink, c.saved, c.score, c.subreddit_id
+    from comment c
+    left join full_text p on p.text_key = c.plaintext_key
+    left join full_text h on h.text_key = c.html_key'''
+
+def _row_comment( row ):
+    return CachedComment({ 'id': row[0], 'author': row[1], 'body': row[2], 'body_html': row[3],
+            'created_utc': row[4], 'edited': row[5] or False, 'link_id': row[6],
+            'parent_id': row[7], 'permalink': row[8], 'saved': bool(row[9]), 'score': row[10],
+            'subreddit_id': row[11] })
+
+
+class CommentStore:
+    """ Keeps the comment cache in a SQLite database using schema-sqlite.sql, the
+        local version of schema.sql.  Comments are returned as CachedComment
+        records, in the order they were saved.
+    """
+
+    def __init__( self, filename: str ):
+        self.db = sqlite3.connect(filename)
+        self.db.execute('pragma journal_mode=wal')
+        self.db.execute('pragma synchronous=normal')
+        with open(file = Path(__file__).parent / 'schema-sqlite.sql', mode = 'r', encoding = 'utf8') as schema:
+            self.db.executescript(schema.read())
+
+
+    def save_comments( self, post_id: str, post_date: date, comments, replace: bool = True ):
+        """ Saves the comments for a post, replacing any saved before, unless
+            replace is False; then the comments are added to those saved.
+        """
+        maps = [ _comment_map(tlc) for tlc in comments ]
+        permalink = ''
+        if maps:
+            # the thread is the comment link without the comment ID
+            permalink = maps[0]['permalink'].rstrip('/').rpartition('/')[0] + '/'
+        with self.db:
+            if replace:
+                self._delete_comments(post_id)
+            self.db.execute('insert or replace into submission (submission_id, title, permalink,'
+                    ' post_date) values (?, coalesce((select title from submission'
+                    ' where submission_id = ?), \'\'), ?, ?)',
+                    ( post_id, post_id, permalink, post_date.isoformat() ))
+            text_key = self.db.execute('select coalesce(max(text_key), 0) from full_text').fetchone()[0]
+            texts = [ ]
+            rows = [ ]
+            for map in maps:
+                texts.append(( text_key + 1, map['id'], map['body'] ))
+                texts.append(( text_key + 2, map['id'], map['body_html'] ))
+                rows.append(( map['id'], map['created_utc'], map['edited'] or None, map['author'],
+                        map['parent_id'], map['score'], map['permalink'], post_id,
+                        text_key + 1, text_key + 2, map['link_id'], map['subreddit_id'],
+                        1 if map['saved'] else 0 ))
+                text_key += 2
+            self.db.executemany('insert into full_text (text_key, comment_id, full_text)'
+                    ' values (?, ?, ?)', texts)
+            self.db.executemany('insert or replace into comment (comment_id, created_time,'
+                    ' edited_time, author_name, parent_id, score, permalink, submission_id,'
+                    ' plaintext_key, html_key, link_id, subreddit_id, saved)'
+                    ' values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+
+    def _delete_comments( self, post_id: str ):
+        self.db.execute('delete from full_text where text_key in (select plaintext_key'
+                ' from comment where submission_id = ? union select html_key from comment'
+                ' where submission_id = ?)', ( post_id, post_id ))
+        self.db.execute('delete from comment where submission_id = ?', ( post_id, ))
+
+
+    def has_post( self, post_id: str, post_date: date ):
+        return self.db.execute('select 1 from submission where submission_id = ? and post_date = ?',
+                ( post_id, post_date.isoformat() )).fetchone() is not None
+
+
+    def iter_comments( self, post_id: str, post_date: date ):
+        if not self.has_post(post_id, post_date):
+            return
+        for row in self.db.execute(f'select {_comment_columns} where c.submission_id = ?'
+                ' order by c.rowid', ( post_id, )):
+            yield _row_comment(row)
+
+
+    def get_comments( self, post_id: str, post_date: date ):
+        """ Returns the list of comments for the post, or None if it is not saved.
+        """
+        if not self.has_post(post_id, post_date):
+            return None
+        return list(self.iter_comments(post_id, post_date))
+
+
+    def month_posts( self, year: int, month: int ):
+        """ Returns ( post ID, post date ) for each post saved in the month.
+        """
+        return [ ( post_id, date.fromisoformat(post_date) ) for post_id, post_date
+                in self.db.execute('select submission_id, post_date from submission'
+                ' where post_date >= ? and post_date < ? order by post_date, submission_id',
+                _month_range(year, month)) ]
+
+
+    def month_comments( self, year: int, month: int ):
+        """ Yields ( post ID, post date, comment ) for every comment in the month,
+            from a single query.
+        """
+        for row in self.db.execute(f'select s.submission_id, s.post_date, {_comment_columns}'
+                ' join submission s on s.submission_id = c.submission_id'
+                ' where s.post_date >= ? and s.post_date < ?'
+                ' order by s.post_date, s.submission_id, c.rowid', _month_range(year, month)):
+            yield row[0], date.fromisoformat(row[1]), _row_comment(row[2:])
+
+
+    def find_comments( self, author: str = None, ids: list = None ):
+        """ Returns the comments by the author (any case, '[deleted]' for none) and
+            with any of the IDs, either of which may be left out.
+        """
+        where = [ ]
+        params = [ ]
+        if author and author.lower() == '[deleted]':
+            where.append('c.author_name is null')
+        elif author:
+            where.append('c.author_name = ? collate nocase')
+            params.append(author)
+        if ids:
+            where.append('c.comment_id in (' + ', '.join('?' * len(ids)) + ')')
+            params += ids
+        query = f'select {_comment_columns}'
+        if where:
+            query += ' where ' + ' and '.join(where)
+        return [ _row_comment(row) for row in self.db.execute(query + ' order by c.rowid', params) ]
+
+
+    def close( self ):
+        self.db.close()
+
+
+def _month_range( year: int, month: int ):
+    if month == 12:
+        return ( date(year, 12, 1).isoformat(), date(year + 1, 1, 1).isoformat() )
+    return ( date(year, month, 1).isoformat(), date(year, month + 1, 1).isoformat() )
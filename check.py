@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
+import argparse
 import datetime
+import fnmatch
 import json
 import re
+import sys
 
-import praw
-
+from cache import CachedComment, CommentStore, load_manifest, read_comment
+from pack import PackedCorpus
 import scanner
 import makers
 import scents
@@ -14,10 +17,60 @@ from pathlib import Path
 
 # spot check for the given data file pattern, username, and comment ID
 check_glob = '202*.json'
+# or set to the SQLite comment store file (e.g. 'sotd.db') to check comments there
+check_store = None
+# or set to the packed corpus file (e.g. 'postdata.pack') to check comments there
+check_pack = None
 
 data_dir = Path('postdata')
-if not data_dir.is_dir():
-    raise Exception('No postdata directory!  I cannot find saved data.')
+
+aparser = argparse.ArgumentParser(description='Spot check the SOTD scanner against saved data')
+aparser.add_argument('--samples', action='store_true',
+        help='Compare the matching engines with their original loops on the\n'
+        'built-in sample comments, without saved data; exits non-zero on any\n'
+        'difference.')
+args = aparser.parse_args()
+
+# comment bodies for the engine comparisons, so they need no saved data
+sample_bodies = {
+    'sample01': '* **Razor:** Karve CB\n\n* **Brush:** Declaration B2\n\n'
+            '* **Lather:** Barrister and Mann - Seville\n\n* **Post Shave:** Stirling Soap Co. Executive Man splash',
+    'sample02': 'Lather: B&M Reserve Fern\n\nBrush: Declaration Grooming B3 in Jefferson\n\nBlade: Astra SP',
+    'sample03': 'Razor: Maggard Razors V3A\nSoap: Stirling - Bay Rum\nAftershave: Stirling Bay Rum splash',
+    'sample04': '**Software:** Declaration Grooming &amp; Chatillon Lux - Sweet Lemon\n\nGreat shave today.',
+    'sample05': 'Lather - Cade from Noble Otter\n\nReally enjoying this one; Noble Otter Barrbarr',
+    'sample06': 'Shave soap: Arsenal Grooming "Il Barbiere"\n\n* **Post Shave:** Murphy and McNeil Gemütlichkeit splash',
+    'sample07': 'Lather: SW - Barbershop 1920\n\n* **Razor:** Blackland Blackbird',
+    'sample08': 'Soap/Cream: Proraso Green (Eucalyptus & Menthol)\n\nBalm: Proraso Green',
+    'sample09': 'Lather: House of Mammoth Hygge\n\nAftershave: Ariana & Evans Peach & Tobacco',
+    'sample10': 'Lather: Seville\n\nI love Barrister and Mann Seville and Stirling Executive Man.',
+    'sample11': 'Cream: Taylor of Old Bond Street Sandalwood\n\nRazor: Merkur 34C',
+    'sample12': 'Shave Cream / Balm: Mäurer & Wirtz Tabac Original',
+    'sample13': 'Lather: [Chicago Grooming Co. - Montrose](https://example.com/montrose)\n\nBrush: Semogue 620',
+    'sample14': 'Lather: Summer Break Soaps Teacher\'s Pet\n\nPost: Summer Break Soaps Teacher\'s Pet',
+    'sample15': 'Lather: Zingari Man - The Watchman\n\nEDT: Zingari Man The Watchman',
+    'sample16': 'Lather: Some Unknown Artisan - Mystery Scent\n\nJust a plain comment with no maker.',
+    'sample17': 'Lather: Wholly Kaw x Chatillon Lux La Pomme d\'Or\n\nArko shave stick, Cella cream',
+    'sample18': 'Lather: APR Maggard Hygge\nLather: Dr. Harris Arlington\nLather: Catie\'s Bubbles Le Grand Chypre',
+    'sample19': '[deleted]',
+    'sample20': '',
+}
+
+
+def check_files( ):
+    """ Returns the paths of the saved data files matching check_glob, from the
+        manifest rather than a directory listing.
+    """
+    return [ data_dir / name for name in sorted(load_manifest().files)
+            if fnmatch.fnmatch(name, check_glob) ]
+
+
+def saved_bodies( ):
+    """ Yields the ID and body of every comment in the check_files(). """
+    for name in check_files():
+        with open(file=name, mode='r', encoding='utf8') as cmt_file:
+            for map in json.load(cmt_file).get('comments'):
+                yield map['id'], map['body']
 
 
 def test_lather_patterns( ):
@@ -28,13 +81,11 @@ def test_lather_patterns( ):
         (?:soap/lather|lath?er|shav(?:ing|e)\\s+(?:soap|cream)|soap/cream|soap|cream|softw[ae]re)\\b
         (?:\\s*(?:/|&(?:amp;|)|and|\\+)\\s*(?:splash|balm|(?:after|post)\\s*shave)|post|)
         (?:\\s*(?:/|&(?:amp;|)|and|\\+)\\s*(?:WH|ed[pt]|fragrance)|)(?!\\s*games)[^a-z0-9]*(\\S.*)''', re.IGNORECASE | re.VERBOSE)
-    for name in data_dir.glob(check_glob):
+    for name in check_files():
         with open(file=name, mode='r', encoding='utf8') as cmt_file:
             jscoms = json.load(cmt_file).get('comments')
             for map in jscoms:
-                if not map['author']:
-                    map['author'] = '[deleted]'
-                comment = praw.reddit.models.Comment(reddit='Reddit', _data=map)
+                comment = CachedComment(map)
 
                 if not comment.author and comment.body == '[deleted]':
                     continue
@@ -87,8 +138,140 @@ def test_lather_patterns( ):
                             print(f"{comment.id} NOW FAILS to match either core or alt patterns!")
 
 
+def _maker_result_key( result ):
+    if not result:
+        return None
+    return ( result['name'], result['match'].span(), result['match'].groups(),
+            result['abbreviated'], result.get('first') )
+
+
+def test_maker_engine( bodies = None ):
+    # makers.matchMaker() must agree with the original pattern-by-pattern loop
+    # for every lather text and every line in the given (id, body) pairs, by
+    # default the saved data; returns the number of differences
+    text_count = 0
+    diff_count = 0
+    for comment_id, body in bodies or saved_bodies():
+        texts = [ line.strip() for line in body.split('\n') if line.strip() ]
+        lmr = scanner.lather_pattern.search(body)
+        if not lmr:
+            lmr = scanner.lather_alt_pattern.search(body)
+        if lmr:
+            texts.append(lmr.group(1).strip())
+        for text in texts:
+            text_count += 1
+            expected = _maker_result_key(makers._matchMakerSerial(text))
+            actual = _maker_result_key(makers.matchMaker(text))
+            if expected != actual:
+                diff_count += 1
+                print(f"{comment_id} matchMaker differs on '{text}':\n  loop={expected}\n  combined={actual}")
+    print(f"Compared {text_count} texts, {diff_count} differences.")
+    return diff_count
+
+
+def test_maker_search( bodies = None ):
+    # makers.searchMaker() must give the same result with and without the
+    # literal prefilter for every comment body; returns the number of differences
+    body_count = 0
+    diff_count = 0
+    for comment_id, body in bodies or saved_bodies():
+        body_count += 1
+        expected = _maker_result_key(makers.searchMaker(body, prefilter=False))
+        actual = _maker_result_key(makers.searchMaker(body))
+        if expected != actual:
+            diff_count += 1
+            print(f"{comment_id} searchMaker differs:\n  all patterns={expected}\n  prefiltered={actual}")
+    print(f"Compared {body_count} comments, {diff_count} differences.")
+    return diff_count
+
+
+def _scent_result_key( result ):
+    if not result:
+        return None
+    span = None
+    if result['match']:
+        span = result['match'].span()
+    return ( result['maker'], result['scent'], span, result['search'] )
+
+
+def test_scent_search( bodies = None ):
+    # scents.findAnyScent() must agree with the original loop over every
+    # pattern, with and without the literal index, for every line of the
+    # given (id, body) pairs, by default the saved data; returns the number
+    # of differences
+    line_count = 0
+    diff_count = 0
+    for comment_id, body in bodies or saved_bodies():
+        for line in body.split('\n'):
+            if not line.strip():
+                continue
+            line_count += 1
+            expected = _scent_result_key(scents._findAnyScentSerial(line.strip()))
+            all_makers = _scent_result_key(scents.findAnyScent(line.strip(), prefilter=False))
+            indexed = _scent_result_key(scents.findAnyScent(line.strip()))
+            if expected != all_makers or expected != indexed:
+                diff_count += 1
+                print(f"{comment_id} findAnyScent differs on '{line.strip()}':\n  loop={expected}\n"
+                        f"  all makers={all_makers}\n  indexed={indexed}")
+    print(f"Compared {line_count} lines, {diff_count} differences.")
+    return diff_count
+
+
+def test_scent_patterns( bodies = None ):
+    # Sniffer.match_on_maker() must agree with the original pattern-by-pattern
+    # loops, for every maker, on every known scent name, and on the scent
+    # text following that maker in the lather lines of the given (id, body)
+    # pairs, by default the saved data; returns the number of differences
+    scents._compile_all()
+    maker_texts = { }
+    all_names = set()
+    for maker in scents._compiled_pats:
+        maker_texts[maker] = set()
+        for sources in scents._compiled_pats[maker].sources[0:2]:
+            all_names |= set(sources.values())
+    for comment_id, body in bodies or saved_bodies():
+        lmr = scanner.lather_pattern.search(body)
+        if lmr:
+            result = makers.matchMaker(lmr.group(1).strip())
+            if result and result['name'] in maker_texts and result['match'].group(1):
+                maker_texts[result['name']].add(result['match'].group(1))
+    text_count = 0
+    diff_count = 0
+    for maker in scents._compiled_pats:
+        so = scents._compiled_pats[maker]
+        for text in all_names | maker_texts[maker]:
+            text_count += 1
+            expected = _scent_result_key(so.match_on_maker(text, combined=False))
+            actual = _scent_result_key(so.match_on_maker(text))
+            if expected != actual:
+                diff_count += 1
+                print(f"{maker} match_on_maker differs on '{text}':\n  loops={expected}\n  combined={actual}")
+    print(f"Compared {text_count} texts, {diff_count} differences.")
+    return diff_count
+
+
 def normalCheck( author = None, ids = None ):
-    for name in data_dir.glob(check_glob):
+    if check_store:
+        # indexed lookups, rather than reading every file
+        for comment in CommentStore(check_store).find_comments(author, ids):
+            scanner.scanBody(comment)
+        return
+    if check_pack:
+        for comment in PackedCorpus(check_pack).iter_all():
+            name = comment.author.name if comment.author else '[deleted]'
+            if ((not author or author.lower() == name.lower())
+                    and (not ids or comment.id in ids)):
+                scanner.scanBody(comment)
+        return
+    if author or ids:
+        # read just the matching comments, found through the comment index
+        for file, offset, comment_id in load_manifest().index.find(author, ids):
+            if fnmatch.fnmatch(file, check_glob):
+                comment = read_comment(data_dir / file, offset, comment_id)
+                if comment:
+                    scanner.scanBody(comment)
+        return
+    for name in check_files():
         with open(file=name, mode='r', encoding='utf8') as cmt_file:
             jscoms = json.load(cmt_file).get('comments')
             for map in jscoms:
@@ -98,13 +281,30 @@ def normalCheck( author = None, ids = None ):
                 if match:
                     match = not ids or len(ids) == 0 or map['id'] in ids
                 if match:
-                    comment = praw.reddit.models.Comment(reddit='Reddit', _data=map)
+                    comment = CachedComment(map)
                     scanner.scanBody(comment)
 
 
 
+def test_samples( ):
+    """ Runs the engine comparisons over the sample_bodies, returning the
+        total number of differences.
+    """
+    bodies = list(sample_bodies.items())
+    return (test_maker_engine(bodies)
+            + test_maker_search(bodies)
+            + test_scent_search(bodies)
+            + test_scent_patterns(bodies))
+
+
 # TODO maybe also note if makers are missing scent patterns
 
-normalCheck( author = '', ids = [ 'gpne3px', 'gt0v5b5' ] )
+if args.samples:
+    if test_samples():
+        sys.exit('The matching engines differ from the original loops!')
+else:
+    if not data_dir.is_dir():
+        raise Exception('No postdata directory!  I cannot find saved data.')
+    normalCheck( author = '', ids = [ 'gpne3px', 'gt0v5b5' ] )
 
 
@@ -1,4 +1,7 @@
+import hashlib
 import re
+from collections import OrderedDict
+from pathlib import Path
 
 separator_pattern = re.compile('\\s*(?:\\\\?-+|–|:|,|\\.|\\|)\\s*')
 
@@ -16,3 +19,367 @@ def strip_separators( text: str ):
             lpos = len(text)
     return text
 
+
+def source_fingerprint( *modules ):
+    """ Returns a hash of the source of the named modules, found next to this
+        one, which changes whenever any of their code does: patterns, tables
+        and functions alike.
+    """
+    digest = hashlib.sha1()
+    for module in modules:
+        digest.update((Path(__file__).parent / f"{module}.py").read_bytes())
+    return digest.hexdigest()[0:16]
+
+
+
+# Pattern analysis, used to cut down how many patterns are tried against a
+# piece of text.  The parser is internal to the re module, hence the fallback.
+try:
+    from re import _parser as sre_parse, _compiler as sre_compile
+except ImportError:
+    import sre_parse, sre_compile
+
+_repeat_ops = ( sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+        getattr(sre_parse, 'POSSESSIVE_REPEAT', None) )
+_zero_width_ops = ( sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT )
+_char_ops = ( sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY )
+
+
+def _first_atoms( items ):
+    """ Returns a list of the parsed items that may match the first character
+        of the sequence, and whether the whole sequence may match nothing.  The
+        list is None when it can't be worked out.
+    """
+    atoms = [ ]
+    for op, av in items:
+        if op in _zero_width_ops:
+            continue
+        elif op in _char_ops:
+            atoms.append((op, av))
+            return atoms, False
+        elif op is sre_parse.SUBPATTERN:
+            if av[1] or av[2]:
+                # inline flags
+                return None, False
+            sub, empty = _first_atoms(av[3])
+        elif op is sre_parse.BRANCH:
+            sub = [ ]
+            empty = False
+            for alt in av[1]:
+                alt_atoms, alt_empty = _first_atoms(alt)
+                if alt_atoms is None:
+                    return None, False
+                sub += alt_atoms
+                empty = empty or alt_empty
+        elif op in _repeat_ops:
+            sub, empty = _first_atoms(av[2])
+            empty = empty or av[0] == 0
+        else:
+            return None, False
+        if sub is None:
+            return None, False
+        atoms += sub
+        if not empty:
+            return atoms, False
+    return atoms, True
+
+
+_ascii_chars = ''.join(chr(i) for i in range(128))
+
+def first_char_table( patterns: list ):
+    """ Maps every ASCII character, and the empty string, to the indices of the
+        given compiled patterns which can match text starting with it, in order.
+        Text starting with anything else has to try every pattern.
+    """
+    table = { '': [ ] }
+    for c in _ascii_chars:
+        table[c] = [ ]
+    atom_chars = { }
+    for i in range(len(patterns)):
+        parsed = sre_parse.parse(patterns[i].pattern, patterns[i].flags)
+        atoms, empty = _first_atoms(parsed)
+        if atoms is None or empty:
+            chars = table.keys()
+        else:
+            chars = set()
+            for atom in atoms:
+                key = ( repr(atom), patterns[i].flags )
+                if key not in atom_chars:
+                    sub = sre_parse.SubPattern(parsed.state, [ atom ])
+                    one = sre_compile.compile(sub, patterns[i].flags)
+                    atom_chars[key] = set(m.group(0) for m in one.finditer(_ascii_chars))
+                chars |= atom_chars[key]
+        for c in chars:
+            table[c].append(i)
+    return table
+
+
+class OrderedAlternation:
+    """ Merges a list of compiled patterns into a single alternation, keeping
+        their order, so one match() call finds the first pattern that would
+        match on its own.  Each alternative is a named group, m0, m1, etc.,
+        mapping it back to its index in the list.  For match(), the
+        alternation is split up by the first character of the text.  All are
+        compiled on first use.
+    """
+
+    def __init__( self, patterns: list ):
+        self.patterns = list(patterns)
+        self.every = tuple(range(len(self.patterns)))
+        self.firsts = None
+        self.combined = { }
+
+
+    def _compile( self, indices: tuple ):
+        if indices not in self.combined:
+            if indices:
+                self.combined[indices] = re.compile('|'.join(
+                        f'(?P<m{i}>{self.patterns[i].pattern})' for i in indices),
+                        self.patterns[indices[0]].flags)
+            else:
+                self.combined[indices] = None
+        return self.combined[indices]
+
+
+    def _first_chars( self ):
+        if self.firsts is None:
+            self.firsts = { }
+            table = first_char_table(self.patterns)
+            for first in table:
+                self.firsts[first] = tuple(table[first])
+
+
+    def compile_all( self ):
+        """ Compiles the alternation for every first character now, rather
+            than on first use.
+        """
+        self._first_chars()
+        for indices in set(self.firsts.values()) | { self.every }:
+            self._compile(indices)
+
+
+    def match( self, text: str ):
+        """ Returns the index of the first pattern matching the beginning of
+            the text, or -1 if there is none.
+        """
+        self._first_chars()
+        combined = self._compile(self.firsts.get(text[0:1], self.every))
+        if combined:
+            result = combined.match(text)
+            if result:
+                return int(result.lastgroup[1:])
+        return -1
+
+
+def _required_runs( items ):
+    """ Returns a list of candidate sets of literal strings for the parsed
+        sequence; any text matching it contains at least one string from each
+        candidate set.
+    """
+    candidates = [ ]
+    runs = { '' }
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            runs = { run + chr(av) for run in runs }
+            continue
+        elif op in _zero_width_ops:
+            # zero width, so the literals on either side are adjacent
+            continue
+        elif (op is sre_parse.IN and len(av) * len(runs) <= 16
+                and all(member[0] is sre_parse.LITERAL for member in av)):
+            # small character set, e.g. [kc]
+            runs = { run + chr(member[1]) for run in runs for member in av }
+            continue
+        if '' not in runs:
+            candidates.append(runs)
+        runs = { '' }
+        if op is sre_parse.SUBPATTERN:
+            if not av[1] and not av[2]:
+                candidates += _required_runs(av[3])
+        elif op is sre_parse.BRANCH:
+            alts = set()
+            for alt in av[1]:
+                best = _best_required(_required_runs(alt))
+                if best is None:
+                    alts = None
+                    break
+                alts |= best
+            if alts:
+                candidates.append(alts)
+        elif op in _repeat_ops and av[0] > 0:
+            candidates += _required_runs(av[2])
+    if '' not in runs:
+        candidates.append(runs)
+    return candidates
+
+
+def _best_required( candidates: list ):
+    best = None
+    for strings in candidates:
+        if not best or (min(len(s) for s in strings), -len(strings)) > (
+                min(len(s) for s in best), -len(best)):
+            best = strings
+    return best
+
+
+def required_literals( pattern ):
+    """ Returns a set of literal strings, at least one of which appears in any
+        text the compiled pattern can match, or None if there is no such set.
+    """
+    best = _best_required(_required_runs(sre_parse.parse(pattern.pattern, pattern.flags)))
+    if best:
+        return frozenset(best)
+    return None
+
+
+_ascii_folds = { }
+
+def _ascii_fold( literal: str, flags ):
+    """ Returns the literal as the lower case ASCII text it matches, or None
+        if it can't match ASCII text at all.
+    """
+    folded = ''
+    for ch in literal:
+        if ch not in _ascii_folds:
+            one = re.compile(re.escape(ch), flags)
+            matches = [ c for c in _ascii_chars if one.fullmatch(c) ]
+            _ascii_folds[ch] = matches[-1] if matches else None
+        if _ascii_folds[ch] is None:
+            return None
+        folded += _ascii_folds[ch]
+    return folded
+
+
+class LiteralScanner:
+    """ Finds which of a collection of literal strings appear in a text, in a
+        single pass.  The literals are arranged in a trie, compiled into one
+        lookahead pattern tried at every position; that finds the longest
+        literal starting there, and the literals that are its prefixes are
+        implied.  This does the job of an Aho-Corasick automaton, running in
+        the regex engine instead of Python code.  ASCII text is lower cased
+        and scanned with a case sensitive pattern, which is a lot quicker.
+    """
+
+    def __init__( self, literals, flags = re.IGNORECASE ):
+        self.literals = sorted(set(literals))
+        self.pattern, self.implied = self._build(self.literals, flags)
+        self.ascii_pattern = None
+        if flags & re.IGNORECASE:
+            folded = [ _ascii_fold(literal, flags) for literal in self.literals ]
+            self.ascii_pattern, self.ascii_implied = self._build(folded, flags & ~re.IGNORECASE)
+
+
+    def _build( self, keys: list, flags ):
+        """ Returns the trie pattern for the keys, and a list mapping each
+            terminal's group number to the literals found when it matches.
+        """
+        trie = { }
+        terminals = { }
+        for i in range(len(keys)):
+            if keys[i] is None:
+                continue
+            node = trie
+            prefixes = [ ]
+            for ch in keys[i]:
+                if None in node:
+                    prefixes.append(node[None])
+                fold = ch.casefold()
+                node = node.setdefault(fold if len(fold) == 1 else ch, { })
+            if None not in node:
+                node[None] = i
+                terminals[i] = [ ]
+            terminals[node[None]].append(( i, prefixes ))
+        implied = { }
+        for term in terminals:
+            implied[term] = set()
+            for i, prefixes in terminals[term]:
+                implied[term].add(i)
+                for prefix in prefixes:
+                    implied[term].update(i for i, _ in terminals[prefix])
+        return re.compile('(?=' + self._trie_pattern(trie) + ')', flags), implied
+
+
+    def _trie_pattern( self, node: dict ):
+        alts = [ ]
+        for ch in node:
+            if ch is not None:
+                alts.append(re.escape(ch) + self._trie_pattern(node[ch]))
+        # terminal last, so longer literals are tried first
+        if None in node:
+            alts.append(f'(?P<l{node[None]}>)')
+        if len(alts) == 1:
+            return alts[0]
+        return '(?:' + '|'.join(alts) + ')'
+
+
+    def scan( self, text: str ):
+        """ Returns the set of literals found in the text.
+        """
+        pattern = self.pattern
+        implied = self.implied
+        if self.ascii_pattern and text.isascii():
+            pattern = self.ascii_pattern
+            implied = self.ascii_implied
+            text = text.lower()
+        found = set()
+        for result in pattern.finditer(text):
+            for i in implied[int(result.lastgroup[1:])]:
+                found.add(self.literals[i])
+        return found
+
+
+class LRUCache:
+    """ A bounded mapping which drops the least recently used entry when full,
+        counting hits, misses and evictions.
+    """
+
+    def __init__( self, size: int ):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get( self, key ):
+        """ Returns the value for the key, or None if it is not cached.
+        """
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+
+    def put( self, key, value ):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def take( self ):
+        """ Returns and clears the counts since the last take(), so a worker
+            process can pass them back to the cache in its parent.
+        """
+        taken = ( self.hits, self.misses, self.evictions )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return taken
+
+
+    def add( self, taken: tuple ):
+        """ Adds counts returned by take() in a worker process.
+        """
+        hits, misses, evictions = taken
+        self.hits += hits
+        self.misses += misses
+        self.evictions += evictions
+
+
+    def summary( self ):
+        return (f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions"
+                f" ({len(self.entries)} of {self.size} entries used)")
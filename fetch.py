@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import TYPE_CHECKING
+
+import scanner
+from common import LRUCache
+
+if TYPE_CHECKING:
+    # only for annotations; praw is imported when it is first needed
+    import praw
+
+
+class RateLimiter:
+    """ A token bucket shared by every thread making Reddit requests: it holds
+        up to burst tokens, refilled at rate per second, and each request
+        takes one, waiting for it if the bucket is empty.  Reddit's own count
+        of the requests left, from each response's headers, can hold all
+        requests back until its window resets.
+    """
+
+    def __init__( self, rate: float, burst: int ):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.resume = 0
+        self.requests = 0
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+
+    def acquire( self ):
+        """ Waits until a request may be made, and counts it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # take the token now, even if it is not there yet, so the threads
+            # waiting are each given the next one in turn
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate, self.resume - now)
+            self.requests += 1
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+
+
+    def update( self, headers ):
+        """ Takes the rate limit headers of a Reddit response; when none of the
+            window's requests are left, no more are made until it ends.
+        """
+        try:
+            remaining = float(headers['x-ratelimit-remaining'])
+            reset = float(headers['x-ratelimit-reset'])
+        except (KeyError, ValueError):
+            return
+        if remaining < 1:
+            with self.lock:
+                self.resume = max(self.resume, time.monotonic() + reset)
+
+
+    def summary( self ):
+        return f"{self.requests} requests, {self.waited:.1f} s waiting for the rate limit"
+
+
+def limited_requestor( limiter: RateLimiter ):
+    """ Returns a prawcore Requestor class for praw.Reddit(requestor_class=),
+        which makes every request wait for the limiter.
+    """
+    import prawcore
+
+    class LimitedRequestor( prawcore.Requestor ):
+        def request( self, *args, **kwargs ):
+            limiter.acquire()
+            response = super().request(*args, **kwargs)
+            limiter.update(response.headers)
+            return response
+
+    return LimitedRequestor
+
+
+def newest_first( post: 'praw.models.Submission' ):
+    """ Sets the post to be loaded newest comments first, 100 top-level
+        comments to the first request, and returns True if that one request
+        has them all, with no "more" comments left to load.
+    """
+    from praw.models import MoreComments
+    post.comment_sort = 'new'
+    post.comment_limit = 100
+    return not any(isinstance(cmt, MoreComments) for cmt in post.comments)
+
+
+class FetchScheduler:
+    """ Loads the comments of several posts at once on a small thread pool,
+        with load( post ).  praw is not thread safe, so each thread has its
+        own Reddit client from connect(); they should all share one limiter.
+        Results come back as futures, so they can be used in the order the
+        posts were given.  praw already retries a request a couple of times;
+        a post whose fetch still fails with a server or connection error is
+        fetched again from the start, up to attempts times in all.
+    """
+
+    def __init__( self, connect, load, workers: int, limiter: RateLimiter, attempts: int = 3 ):
+        self.connect = connect
+        self.load = load
+        self.limiter = limiter
+        self.attempts = attempts
+        self.local = threading.local()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch')
+        self.latencies = [ ]
+        self.retries = 0
+        self.single = 0
+        self.lock = threading.Lock()
+
+
+    def submit( self, post_id: str, newest: bool = False ):
+        """ Returns a future for ( post, comments, seconds ): the post, all its
+            top-level comments, and how long that took.  With newest, for a
+            post already cached, the comments are fetched newest first and
+            returned in the order they were made, so a post with few of them
+            takes a single request, and new ones come after the cached ones
+            when merged.
+        """
+        return self.pool.submit(self._fetch, post_id, newest)
+
+
+    def _fetch( self, post_id: str, newest: bool ):
+        from prawcore.exceptions import RequestException, ServerError
+        reddit = getattr(self.local, 'reddit', None)
+        if reddit is None:
+            reddit = self.local.reddit = self.connect()
+        start = time.perf_counter()
+        for attempt in range(self.attempts):
+            try:
+                post = reddit.submission(id=post_id)
+                if newest and newest_first(post):
+                    with self.lock:
+                        self.single += 1
+                else:
+                    # the rest of them, after the first request's
+                    self.load(post)
+                comments = list(post.comments)
+                if newest:
+                    comments.sort(key=lambda cmt: cmt.created_utc)
+                break
+            except (RequestException, ServerError):
+                if attempt + 1 == self.attempts:
+                    raise
+                with self.lock:
+                    self.retries += 1
+        elapsed = time.perf_counter() - start
+        # list.append() is atomic
+        self.latencies.append(elapsed)
+        return post, comments, elapsed
+
+
+    def close( self ):
+        # fetches not yet started are dropped, if the run stopped early
+        self.pool.shutdown(cancel_futures=True)
+
+
+    def summary( self ):
+        if not self.latencies:
+            return f"no posts fetched, {self.limiter.summary()}"
+        return (f"{len(self.latencies)} posts fetched ({self.single} in a single request,"
+                f" {self.retries} fetched again after errors),"
+                f" {self.limiter.summary()}; fetch latency median {statistics.median(self.latencies):.2f} s,"
+                f" max {max(self.latencies):.2f} s")
+
+
+post_index_filename = 'post-index.db'
+
+
+class IndexedPost:
+    """ A SOTD post as the PostIndex keeps it; like a praw Submission, it has
+        the id and title.  Along with when it was last fetched are its high
+        water marks from then: Reddit's count of its comments and replies,
+        and the latest time a comment was made and edited.
+    """
+    __slots__ = ( 'id', 'post_date', 'title', 'permalink', 'created_utc', 'last_fetched',
+            'comment_count', 'listed_comments', 'fetched_comments', 'newest_created', 'newest_edited' )
+
+    def __init__( self, row: tuple ):
+        ( self.id, post_date, self.title, self.permalink, self.created_utc, self.last_fetched,
+                self.comment_count, self.listed_comments, self.fetched_comments, self.newest_created,
+                self.newest_edited ) = row
+        self.post_date = date.fromisoformat(post_date)
+
+
+    def unchanged( self, comments: list ):
+        """ Returns True if Reddit's comment count in the latest listing is the
+            same as when the post was last fetched, and the cached comments
+            still have the high water marks they had then, so there is nothing
+            new.  Otherwise the post should be fetched again in full.
+        """
+        return (self.last_fetched is not None and self.listed_comments == self.fetched_comments
+                and self.newest_created == max(( cmt.created_utc for cmt in comments ), default=None)
+                and self.newest_edited == max(( cmt.edited or 0 for cmt in comments ), default=None))
+
+
+class PostIndex:
+    """ Keeps the SOTD posts found on Reddit in a SQLite file, with the date
+        each is for, so a run finds the posts it needs without walking the
+        subreddit.  discover_new() and discover_month() fill it in.  It also
+        keeps the state of each post when last fetched, so incremental runs
+        can tell which have changed.
+    """
+
+    def __init__( self, filename: str = post_index_filename ):
+        self.db = sqlite3.connect(filename)
+        self.db.executescript('''
+            create table if not exists post_index (
+                post_id text not null
+                , post_date text not null
+                , title text not null
+                , permalink text not null
+                , created_utc real not null
+                , last_fetched real
+                , comment_count int
+                , listed_comments int
+                , fetched_comments int
+                , newest_created real
+                , newest_edited real
+                , primary key (post_id)
+                );
+            create index if not exists post_index_post_date on post_index (post_date);
+            create table if not exists searched_month (
+                month text not null
+                , searched real not null
+                , primary key (month)
+                );
+            ''')
+        # an index from before the high water marks were kept
+        columns = [ row[1] for row in self.db.execute('pragma table_info(post_index)') ]
+        for column, kind in ( ( 'listed_comments', 'int' ), ( 'fetched_comments', 'int' ),
+                ( 'newest_created', 'real' ), ( 'newest_edited', 'real' ) ):
+            if column not in columns:
+                self.db.execute(f'alter table post_index add column {column} {kind}')
+
+
+    def add( self, post: 'praw.models.Submission', post_date: date ):
+        """ Adds the post from a listing, or updates it with the listing's
+            comment count.
+        """
+        self.db.execute('insert into post_index (post_id, post_date, title, permalink, created_utc,'
+                ' listed_comments) values (?, ?, ?, ?, ?, ?) on conflict (post_id) do update set'
+                ' post_date = excluded.post_date, title = excluded.title, permalink = excluded.permalink,'
+                ' created_utc = excluded.created_utc, listed_comments = excluded.listed_comments',
+                ( post.id, post_date.isoformat(), post.title, post.permalink, post.created_utc,
+                post.num_comments ))
+
+
+    def posts( self, first: date, last: date ):
+        """ Returns the posts for the dates from first to last, as IndexedPost,
+            in date order.
+        """
+        return [ IndexedPost(row) for row in self.db.execute('select post_id, post_date, title, permalink,'
+                ' created_utc, last_fetched, comment_count, listed_comments, fetched_comments,'
+                ' newest_created, newest_edited from post_index where post_date >= ?'
+                ' and post_date <= ? order by post_date, created_utc', ( first.isoformat(), last.isoformat() )) ]
+
+
+    def fetched( self, post_id: str, comments: list, num_comments: int ):
+        """ Records that the post was just fetched: the comments now cached for
+            it, and Reddit's count of its comments and replies.
+        """
+        self.db.execute('update post_index set last_fetched = ?, comment_count = ?, fetched_comments = ?,'
+                ' listed_comments = ?, newest_created = ?, newest_edited = ? where post_id = ?',
+                ( time.time(), len(comments), num_comments, num_comments,
+                max(( cmt.created_utc for cmt in comments ), default=None),
+                max(( cmt.edited or 0 for cmt in comments ), default=None), post_id ))
+
+
+    def post( self, post_id: str ):
+        """ Returns the post as an IndexedPost, or None if it is not indexed.
+        """
+        row = self.db.execute('select post_id, post_date, title, permalink, created_utc, last_fetched,'
+                ' comment_count, listed_comments, fetched_comments, newest_created, newest_edited'
+                ' from post_index where post_id = ?', ( post_id, )).fetchone()
+        return IndexedPost(row) if row else None
+
+
+    def month_searched( self, year: int, month: int ):
+        return self.db.execute('select 1 from searched_month where month = ?',
+                ( f"{year:0>4}-{month:0>2}", )).fetchone() is not None
+
+
+    def mark_searched( self, year: int, month: int ):
+        self.db.execute('insert or replace into searched_month values (?, ?)',
+                ( f"{year:0>4}-{month:0>2}", time.time() ))
+
+
+    def commit( self ):
+        self.db.commit()
+
+
+    def close( self ):
+        self.db.commit()
+        self.db.close()
+
+
+def _created_date( post: 'praw.models.Submission' ):
+    return datetime.fromtimestamp(post.created_utc, timezone.utc).date()
+
+
+def _sotd_date( post: 'praw.models.Submission' ):
+    """ Returns the date of the SOTD post, or None if it is not one.
+    """
+    post_date = scanner.get_sotd_date(post)
+    # a date far from when it was posted is a mistake in the title
+    if post_date and abs((_created_date(post) - post_date).days) <= 3:
+        return post_date
+    return None
+
+
+def discover_new( index: PostIndex, subreddit: 'praw.models.Subreddit', since: date ):
+    """ Adds the SOTD posts in the subreddit's new listing to the index, back
+        to those posted the day before since.  Unlike hot, new is in the order
+        posted, so it can be stopped there.  Reddit lists only the latest
+        thousand posts, a few weeks' worth.  Returns the number of posts seen.
+    """
+    seen = 0
+    for post in subreddit.new(limit=None):
+        if _created_date(post) < since - timedelta(days=1):
+            break
+        seen += 1
+        post_date = _sotd_date(post)
+        if post_date:
+            index.add(post, post_date)
+    index.commit()
+    return seen
+
+
+def _month_queries( year: int, month: int ):
+    """ Returns the searches for SOTD posts in the month, covering each way
+        scanner.get_sotd_date() reads a date in a title: the month's name or
+        abbreviation with the year, yyyy-mm-dd, and mm/dd/yyyy or mm/dd/yy.
+        Search splits titles into words at the dashes and slashes.
+    """
+    first = date(year, month, 1)
+    queries = [ f"title:SOTD title:{name} title:{year}"
+            for name in sorted(set(( first.strftime('%b'), first.strftime('%B') ))) ]
+    queries.append(f"title:SOTD title:{month:0>2} title:{year}")
+    queries.append(f"title:SOTD title:{month:0>2} title:{year % 100:0>2}")
+    return queries
+
+
+def discover_month( index: PostIndex, subreddit: 'praw.models.Subreddit', year: int, month: int ):
+    """ Adds the month's SOTD posts to the index, unless it already has them
+        all.  Search finds posts by the date in their titles, in any of the
+        formats read; the new listing finds them however they are dated, if
+        it goes back far enough.  Once the month is over and the index has a
+        post for each of its days, it is not searched again.  Returns the
+        number of posts seen.
+    """
+    if index.month_searched(year, month):
+        return 0
+    first = date(year, month, 1)
+    following = date(year + month // 12, month % 12 + 1, 1)
+    seen = 0
+    for query in _month_queries(year, month):
+        for post in subreddit.search(query, sort='new', limit=None):
+            seen += 1
+            post_date = scanner.get_sotd_date(post)
+            if post_date and first <= post_date < following:
+                index.add(post, post_date)
+    if date.today() - first < timedelta(days=45):
+        seen += discover_new(index, subreddit, first)
+    days = set(post.post_date for post in index.posts(first, following - timedelta(days=1)))
+    if date.today() > following + timedelta(days=1) and len(days) == (following - first).days:
+        index.mark_searched(year, month)
+    index.commit()
+    return seen
+
+
+class SotdThreads:
+    """ Tells which threads comments in the subreddit's comment stream are on
+        are SOTD posts, and for which dates.  A thread not in the post index is
+        fetched, and added to it if it is one.  The latest threads looked up
+        are kept in a bounded cache, as most comments are on a few of them.
+    """
+
+    def __init__( self, reddit: 'praw.Reddit', index: PostIndex, size: int = 256 ):
+        self.reddit = reddit
+        self.index = index
+        # post ID: post date, or False if it is not a SOTD post
+        self.threads = LRUCache(size)
+        self.fetched = 0
+
+
+    def post_date( self, comment: 'praw.models.Comment' ):
+        """ Returns the date of the SOTD post the comment is on, or None.
+        """
+        post_id = comment.link_id.partition('_')[2]
+        post_date = self.threads.get(post_id)
+        if post_date is None:
+            post = self.index.post(post_id)
+            if post:
+                post_date = post.post_date
+            else:
+                submission = self.reddit.submission(id=post_id)
+                self.fetched += 1
+                post_date = _sotd_date(submission) or False
+                if post_date:
+                    self.index.add(submission, post_date)
+                    self.index.commit()
+            self.threads.put(post_id, post_date)
+        return post_date or None
+
+
+stream_checkpoint_filename = 'stream-checkpoint.json'
+
+
+class StreamCheckpoint:
+    """ Records how far the comment stream has been read: the time the newest
+        comment was made, and its ID.  A stream started again skips comments
+        made well before then, and can tell whether some may have been missed.
+    """
+
+    def __init__( self, filename: str = stream_checkpoint_filename ):
+        self.filename = filename
+        self.created_utc = None
+        self.id = None
+        try:
+            with open(file=filename, mode='r', encoding='utf8') as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            self.created_utc = saved['created_utc']
+            self.id = saved['id']
+        except FileNotFoundError:
+            pass
+        self.resumed_from = self.created_utc
+
+
+    def seen( self, comment: 'praw.models.Comment' ):
+        """ Returns True if the comment was read by an earlier stream, and
+            otherwise moves the checkpoint up to it if it is the newest.
+        """
+        # comments are not always listed in exactly the order they were made,
+        # so those just before the checkpoint are let through; saving a
+        # comment twice is caught when it is saved
+        if self.resumed_from is not None and comment.created_utc < self.resumed_from - 60:
+            return True
+        if self.created_utc is None or comment.created_utc >= self.created_utc:
+            self.created_utc = comment.created_utc
+            self.id = comment.id
+        return False
+
+
+    def save( self ):
+        """ Writes the checkpoint under a temporary name and renames it, so it is
+            never left half written.
+        """
+        if self.created_utc is None:
+            return
+        temp_name = self.filename + '.tmp'
+        with open(file=temp_name, mode='w', encoding='utf8') as checkpoint_file:
+            json.dump({ 'created_utc': self.created_utc, 'id': self.id }, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_name, self.filename)
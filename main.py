@@ -1,28 +1,51 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
+import contextlib
+import gc
+import io
+import itertools
+import multiprocessing
 import re
-from datetime import date, timedelta, datetime
+import signal
+import time
+from datetime import date, timedelta
 from enum import Enum, auto
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import praw
-from prawcore.exceptions import NotFound
-
+import cache
+import common
+import fetch
+from cache import get_cached_comments, iter_cached_comments, save_comments_to_cache
+import memo
+import pack
 import scanner
+import scents
+
+if TYPE_CHECKING:
+    # only for annotations; connect() imports praw when it is needed
+    import praw
 
 class Mode(Enum):
     INCREMENTAL = auto()
     COMPILE = auto()
     ONE = auto()
+    STORE = auto()
+    PACK = auto()
+    CONVERT = auto()
+    STREAM = auto()
 
 aparser = argparse.ArgumentParser(description='Load SOTD data from r/Wetshaving')
-aparser.add_argument('command', choices=['compile', 'comp', 'incremental', 'inc', 'one'],
-        help='Specify the command; a monthly compilation, incremental update, or single post.')
+aparser.add_argument('command', choices=['compile', 'comp', 'incremental', 'inc', 'one', 'store', 'pack',
+        'convert', 'stream'],
+        help='Specify the command; a monthly compilation, incremental update, single post,\n'
+        'copying the file cache into the SQLite comment store, packing it into one file,\n'
+        'rewriting it in the --cache-format file format, or following the subreddit\n'
+        'comment stream, saving and scanning SOTD comments as they are made.')
 aparser.add_argument('--id', help='Specify the post ID for mode "one."')
 aparser.add_argument('--delimiter', choices=[',', 'comma', '\\t', 'tab'],
-        help='Specify the CSV delimiter for compilation only.')
+        help='Specify the CSV delimiter (compilation and stream only).')
 aparser.add_argument('--month', metavar='{mm|yyyy-mm}',
         help='Specify the month (current year) or month and year.\n'
         'The default is to compile data for the previous month, or perform\n'
@@ -31,22 +54,50 @@ aparser.add_argument('--live', action='store_true',
         help='Look for posts on Reddit, not in file cache (compilation only).')
 aparser.add_argument('--date', 
         help='Specify a post date ("one" mode only).')
+aparser.add_argument('--pack', action='store_true',
+        help='Read comments from the packed corpus the pack command writes (compilation only).')
+aparser.add_argument('--workers', type=int, default=1,
+        help='Specify how many processes scan the file cache (compilation only).')
+aparser.add_argument('--cache-format', choices=['json', 'jsonl', 'log', 'jsonl.gz', 'jsonl.xz', 'sqlite'],
+        default='json',
+        help='Specify the format for saving comments to the file cache; any file format\n'
+        'is read.  With log, new and edited comments are appended to each post\'s file;\n'
+        'jsonl.gz and jsonl.xz are jsonl compressed with gzip or lzma.\n'
+        'With sqlite, comments are saved to and read from the comment store.')
+aparser.add_argument('--no-memo', action='store_true',
+        help='Rescan every comment, ignoring results saved by earlier runs (compilation only).')
 aparser.add_argument('--days', type=int, default=5,
         help='Specify how many days to go back (incremental mode only).')
+aparser.add_argument('--fetchers', type=int, default=4,
+        help='Specify how many posts to fetch from Reddit at once (incremental mode only).')
+aparser.add_argument('--rate', type=float, default=60,
+        help='Specify the most requests a minute to make to Reddit, across all fetchers.')
+aparser.add_argument('--reddit-url', metavar='URL',
+        help='Fetch from a stand-in for Reddit at the URL, such as replay.py serves,\n'
+        'rather than from Reddit with the praw.ini credentials.')
 args = aparser.parse_args()
+cache.cache_format = args.cache_format
+if args.rate <= 0:
+    raise SystemExit("The request rate must be positive.")
 
-if args.command in [ 'comp', 'compile' ]:
-    arg_mode = Mode.COMPILE
+if args.command in [ 'comp', 'compile', 'stream' ]:
     if args.delimiter in [ ',', 'c', 'comma' ]:
         arg_delimiter = ','
     elif args.delimiter in [ '\t', '\\t', 't', 'tab' ]:
         arg_delimiter = '\t'
     else:
         raise SystemExit("Missing or invalid delimiter: select tab or comma with --delimiter.")
+
+if args.command in [ 'comp', 'compile' ]:
+    arg_mode = Mode.COMPILE
+    if args.workers < 1:
+        raise SystemExit("Workers must be a positive integer.")
 elif args.command in [ 'inc', 'incremental' ]:
     arg_mode = Mode.INCREMENTAL
     if args.days < 1:
         raise SystemExit("Days to check must be a positive integer.")
+    if args.fetchers < 1:
+        raise SystemExit("Fetchers must be a positive integer.")
 elif args.command in [ 'one' ]:
     arg_mode = Mode.ONE
     if not args.id or not args.date:
@@ -57,6 +108,19 @@ elif args.command in [ 'one' ]:
     arg_date = date(int(result.group(1)), int(result.group(2)), int(result.group(3)))
     if arg_date.year < 2020 or arg_date > date.today():
         raise SystemExit(f"Post date '{args.post_date}' is not expected: too early or in the future")
+elif args.command in [ 'store' ]:
+    arg_mode = Mode.STORE
+    # the files are copied, whatever the format
+    cache.cache_format = 'json'
+elif args.command in [ 'pack' ]:
+    arg_mode = Mode.PACK
+    cache.cache_format = 'json'
+elif args.command in [ 'convert' ]:
+    arg_mode = Mode.CONVERT
+    if cache.cache_format == 'sqlite':
+        raise SystemExit("Use the store command to copy the file cache into the comment store.")
+elif args.command in [ 'stream' ]:
+    arg_mode = Mode.STREAM
 else:
     raise SystemExit(f"Invalid command \"{args['command']}\" specified.")
 
@@ -85,237 +149,545 @@ if args.month:
         raise SystemExit(f"{aparser.prog}: error: '{args.month}' is in the future!")
 
 
-def get_cached_comments( post_id: str, post_date: date ):
-    """ If the given post ID with the given date is found in the cache, the
-        list of comments is returned.  Otherwise None is returned.
-    """
-    # note the filename generation MUST match save_comments_to_cache()!
-    filename = f"postdata/{post_date.strftime('%Y-%m-%d')}-{post_id}.json"
-    if Path(filename).exists():
-        with open(file = filename, mode = 'r', encoding = 'utf8') as comments_file:
-            try:
-                jscoms = json.load(comments_file).get('comments')
-            except Exception as e:
-                print(f"Error loading cache file {filename}: {e}")
-                return None
-            rdcoms = [ ]
-            for cmt in jscoms:
-                if not cmt['author']:
-                    cmt['author'] = '[deleted]'
-                rdcoms.append(praw.reddit.models.Comment(reddit='Reddit', _data=cmt))
-            return rdcoms
-    return None
-
-
-def save_comments_to_cache( post_id: str, post_date: date, comments ):
-    """ Saves the given collection of comments to the file cache.  This will
-        overwrite any existing cache for the post.
-    """
-    # note the filename generation MUST match get_cached_comments()!
-    filename = f"postdata/{post_date.strftime('%Y-%m-%d')}-{post_id}.json"
-    Path('postdata').mkdir(exist_ok = True)
-    with open(file = filename, mode = 'w', encoding = 'utf8') as comment_file:
-        comment_count = 0
-        comment_file.write('{"comments": [\n')
-        for tlc in comments:
-            comment_count += 1
-            author_name = None
-            if tlc.author:
-                author_name = tlc.author.name
-            # apparently created_utc is actually created CST?
-            # at least for me it is, and for other posts the conversion is
-            # the same from web -> created_utc
-            # edited appears to work the same despite not being named _utc
-            map = {
-                'author': author_name,
-                'id': tlc.id,
-                'body': tlc.body,
-                'body_html': tlc.body_html,
-                'created_utc': tlc.created_utc,
-                'edited': tlc.edited,
-                'link_id': tlc.link_id,
-                'parent_id': tlc.parent_id,
-                'permalink': tlc.permalink,
-                'saved': tlc.saved,
-                'score': tlc.score,
-                'subreddit_id': tlc.subreddit_id
-            }
-            if tlc.edited:
-                map['edited'] = tlc.edited
-            if comment_count > 1:
-                comment_file.write(',\n')
-            comment_file.write(json.dumps(map))
-        comment_file.write('\n]}')
-
-
-def ensure_loaded( post: praw.models.Submission ):
+def ensure_loaded( post: 'praw.models.Submission' ):
     """ Returns a list of all top-level comments in the given submission.
         Reddit does not guarantee all top-level comments are loaded; this
         function will.
     """
+    from praw.models import MoreComments
     complete = False
     while not complete:
         complete = True
         for tlc in post.comments:
-            if isinstance(tlc, praw.models.MoreComments):
+            if isinstance(tlc, MoreComments):
                 complete = False
                 post.comments.replace_more(limit=None)
                 break
 
 
+def is_deleted( comment ):
+    return comment.body in ( '[deleted]', '[removed]' )
+
+
 def update_cache_comments( cached: list, reddit_comments ):
-    """ Adds any missing comments to the cached list, from the Reddit comments
-        collection.  Returns True if the list was added to, or False if not.
+    """ Merges the Reddit comments collection into the cached list.  Missing
+        comments are added at the end, and comments edited since they were
+        cached are replaced.  Comments since deleted on Reddit, or no longer
+        returned at all, keep their cached copy.  Returns the lists of added
+        and edited comments, and the number deleted: ( added, edited, deleted ).
     """
-    updated = False
+    positions = { }
+    for i in range(len(cached)):
+        positions[cached[i].id] = i
+    added = [ ]
+    edited = [ ]
+    deleted = 0
+    seen = set()
     for comment in reddit_comments:
-        found = False
-        for cc in cached:
-            if cc.id == comment.id:
-                found = True
-                break
-        if not found:
+        seen.add(comment.id)
+        i = positions.get(comment.id)
+        if i is None:
+            positions[comment.id] = len(cached)
             cached.append(comment)
-            updated = True
-    return updated
+            added.append(comment)
+        elif is_deleted(comment):
+            if not is_deleted(cached[i]):
+                deleted += 1
+        elif comment.edited != cached[i].edited or comment.body != cached[i].body:
+            cached[i] = comment
+            edited.append(comment)
+    for cc in cached:
+        if cc.id not in seen:
+            deleted += 1
+    return added, edited, deleted
 
 
-def comp_from_file():
-    # TODO duplicate detection:
-    # same lather info & posts within a few minutes of each other (10?)
-    # or same lather & posts to multiple threads on the same day
-    file_pat = re.compile('^(\\d{4})-(\\d\\d)-(\\d\\d)-(\\w+).json$')
-    post_proc_count = 0
-    comment_count = 0
-    for fp in Path('postdata').glob("*json"):
-        result = file_pat.match(fp.name)
-        if not result or sotd_year != int(result.group(1)) or sotd_month != int(result.group(2)):
+# the PackedCorpus compiles read from, with --pack
+packed = None
+
+def post_comments( post_id: str, post_date: date ):
+    """ Returns an iterator over the comments for a post, from the packed
+        corpus or the cache.
+    """
+    if packed:
+        return packed.iter_comments(post_id, post_date)
+    return iter_cached_comments(post_id, post_date)
+
+
+def write_headers( dataFile ):
+    """ Writes the CSV header row for the rows scanner.scanComment() writes.
+    """
+    # TODO put this together with scanner.scanComment(...)
+    headers = [ 'Date', 'Time', 'Author', 'Maker', 'Scent', 'Confidence',
+            'Lather', 'ID', 'Plaintext', 'URL' ]
+    if arg_delimiter == ',':
+        dataFile.write('"')
+    for i in range(len(headers)):
+        if arg_delimiter == '\t' and i >= 8:
             continue
-        post_date = date(int(result.group(1)), int(result.group(2)), int(result.group(3)))
-        comments = get_cached_comments(result.group(4), post_date)
-        if not comments:
-            print(f"ERROR: failed to load comments from '{fp}'")
-        else:
-            post_proc_count += 1
+        if i > 0:
+            if arg_delimiter == ',':
+                dataFile.write('","')
+            else:
+                dataFile.write(arg_delimiter)
+        dataFile.write(headers[i])
+    if arg_delimiter == ',':
+        dataFile.write('"')
+    dataFile.write('\n')
+    # end TODO
+
+
+def scan_comments( fp, comments, post_date: date, out ):
+    """ Scans the comments for one post as they are read, writing CSV rows to
+        out.  Returns the number of comments, or None if there were none or
+        they could not all be read, when nothing is written.
+    """
+    rows = io.StringIO()
+    comment_count = 0
+    try:
         for cmt in comments:
             comment_count += 1
             try:
-                scanner.scanComment(cmt, post_date, dataFile, arg_delimiter)
+                scanner.scanComment(cmt, post_date, rows, arg_delimiter)
             except Exception as e:
                 raise Exception(f"Error processing '{cmt.id}'", e)
+    except cache.CacheFileError:
+        # as when the whole file failed to load, none of the post is written
+        comment_count = 0
+    if comment_count == 0:
+        print(f"ERROR: failed to load comments from '{fp}'")
+        return None
+    out.write(rows.getvalue())
+    return comment_count
+
+
+def scan_in_worker( post: tuple ):
+    """ Scans one cached post in a worker process, returning the CSV rows and
+        log output for the parent to write in order, with memo results.
+    """
+    fp, post_id, post_date = post
+    stores = ( scents.match_cache, scanner.lather_memo, scanner.scan_store )
+    for store in stores:
+        if store:
+            # drop anything inherited from the parent or an earlier post
+            store.take()
+    out = io.StringIO()
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        count = scan_comments(fp, post_comments(post_id, post_date), post_date, out)
+    taken = [ store.take() if store else None for store in stores ]
+    return out.getvalue(), log.getvalue(), count, taken
+
+
+def cached_files( month_only: bool = True ):
+    """ Returns ( file path, post ID, post date ) for each post in the file
+        cache, for the month being compiled unless month_only is False.
+    """
+    # month_files() checks the month's files itself
+    manifest = cache.load_manifest(check_files=not month_only)
+    if month_only:
+        names = manifest.month_files(sotd_year, sotd_month)
+    else:
+        names = sorted(manifest.files)
+    manifest.save()
+    posts = [ ]
+    seen = set()
+    # in the order get_cached_comments() looks for the formats
+    names.sort(key=lambda name: ( name.partition('.')[0], cache.file_formats.index(name.partition('.')[2]) ))
+    for name in names:
+        entry = manifest.files[name]
+        post_date = date.fromisoformat(entry['post_date'])
+        # get_cached_comments() reads one format when a post has both
+        if ( entry['post_id'], post_date ) in seen:
+            continue
+        seen.add(( entry['post_id'], post_date ))
+        posts.append(( Path('postdata') / name, entry['post_id'], post_date ))
+    return posts
+
+
+def comp_from_file():
+    # TODO duplicate detection:
+    # same lather info & posts within a few minutes of each other (10?)
+    # or same lather & posts to multiple threads on the same day
+    global packed
+    if args.pack:
+        # opened before any workers are forked, so they share its pages
+        packed = pack.PackedCorpus(pack.pack_filename)
+        posts = [ ( pack.pack_filename, post_id, post_date ) for post_id, post_date
+                in packed.month_posts(sotd_year, sotd_month) ]
+        pack_mtime = Path(pack.pack_filename).stat().st_mtime_ns
+        manifest = cache.load_manifest(check_files=False)
+        for name in manifest.month_files(sotd_year, sotd_month):
+            if manifest.files[name]['mtime'] > pack_mtime:
+                print(f"WARNING: {name} has changed since {pack.pack_filename} was written.")
+    elif cache.cache_format == 'sqlite':
+        posts = [ ( cache.store_filename, post_id, post_date ) for post_id, post_date
+                in cache.comment_store().month_posts(sotd_year, sotd_month) ]
+    else:
+        posts = cached_files()
+    post_proc_count = 0
+    comment_count = 0
+    if args.workers > 1 and len(posts) > 1:
+        # compile everything before forking and keep the collector away from it,
+        # so the workers share the parent's pattern tables copy-on-write
+        scanner.precompile()
+        gc.freeze()
+        with multiprocessing.get_context('fork').Pool(args.workers) as pool:
+            # imap() returns results in order, so the output matches a serial run
+            for rows, log, count, taken in pool.imap(scan_in_worker, posts):
+                print(log, end='')
+                dataFile.write(rows)
+                for store, counts in zip(( scents.match_cache, scanner.lather_memo, scanner.scan_store ), taken):
+                    if store:
+                        store.add(counts)
+                if count is not None:
+                    post_proc_count += 1
+                    comment_count += count
+        gc.unfreeze()
+    elif cache.cache_format == 'sqlite' and not packed:
+        # one query for the whole month, taken a post at a time
+        month = cache.comment_store().month_comments(sotd_year, sotd_month)
+        for ( post_id, post_date ), rows in itertools.groupby(month, key=lambda row: row[0:2]):
+            count = scan_comments(cache.store_filename, ( row[2] for row in rows ), post_date, dataFile)
+            if count is not None:
+                post_proc_count += 1
+                comment_count += count
+    else:
+        for fp, post_id, post_date in posts:
+            count = scan_comments(fp, post_comments(post_id, post_date), post_date, dataFile)
+            if count is not None:
+                post_proc_count += 1
+                comment_count += count
     print(f"Processed {comment_count} comments in {post_proc_count} files.")
 
 
 
-# if incremental: loop over posts until you go back one week, or two days prior to last known
+# if incremental: fetch the posts for the last few days
 # if compile: visit all posts in one month
-def do_the_work( subreddit: praw.models.Subreddit, mode: Mode ):
-    limit_days = args.days
-    post_count = 0
+def do_the_work( reddit: 'praw.Reddit', mode: Mode, scheduler: fetch.FetchScheduler = None ):
+    subreddit = reddit.subreddit('Wetshaving')
+    # the posts are found through the post index, filled in from Reddit
+    # listings and searches as needed
+    index = fetch.PostIndex()
+    # one manifest for all the posts saved
+    cache.keep_manifest()
     post_proc_count = 0
-    inc_limit = date.today() - timedelta(days=limit_days)
-    last_inc_loaded = date.today()
-    for post in subreddit.hot(limit=None):
-        post_count += 1
-        post_date = scanner.get_sotd_date(post)
-        if not post_date:
-            continue
+    if mode == Mode.INCREMENTAL:
+        inc_limit = date.today() - timedelta(days=args.days)
+        post_count = fetch.discover_new(index, subreddit, inc_limit)
+        posts = index.posts(inc_limit, date.today())
+    elif mode == Mode.COMPILE:
+        post_count = fetch.discover_month(index, subreddit, sotd_year, sotd_month)
+        posts = index.posts(date(sotd_year, sotd_month, 1),
+                date(sotd_year + sotd_month // 12, sotd_month % 12 + 1, 1) - timedelta(days=1))
+    else:
+        raise SystemExit(f"Unknown mode '{mode}'")
+    # ( post, cached comments, future ) for posts being fetched in incremental
+    # mode, merged and saved in order
+    fetching = [ ]
+    for post in posts:
         if mode == Mode.INCREMENTAL:
-            if post_date >= date.today():
+            if post.post_date >= date.today():
                 print(f'Skipping thread {post.title}; too recent and it may not be complete.')
                 continue
-            #elif post_date >= inc_limit:
-                # TODO merge
-            elif abs((last_inc_loaded - post_date).days) > 3 * limit_days:
-                print(f'Weird date on {post.id} "{post.title}"; skipping.')
+            comments = get_cached_comments(post.id, post.post_date)
+            if not comments:
+                post_proc_count += 1
+            elif post.unchanged(comments):
+                print(f"No new comments in {post.title} since it was last fetched.")
                 continue
-            elif post_date <= inc_limit and (last_inc_loaded - post_date).days > 7:
-                print('Looks like we\'re finished loading.')
-                break
-            else:
-                comments = get_cached_comments(post.id, post_date)
-                if comments:
-                    ensure_loaded(post)
-                    if update_cache_comments(comments, post.comments):
-                        print(f"Found new/updated comments in {post.title}.")
-                        last_inc_loaded = post_date
-                        save_comments_to_cache(post.id, post_date, comments)
-                    else:
-                        print(f"Loaded cache for {post.title}.")
-                else:
-                    post_proc_count += 1
-                    ensure_loaded(post)
-                    save_comments_to_cache(post.id, post_date, post.comments)
-                    last_inc_loaded = post_date
-                    print(f"Saved {len(post.comments)} comments from {post.title}.")
+            # with comments cached, the newest are fetched first, as most
+            # changed posts have few enough for one request
+            fetching.append(( post, comments, scheduler.submit(post.id, bool(comments)) ))
         elif mode == Mode.COMPILE:
             # TODO duplicate detection:
             # same lather info & posts within a few minutes of each other (10?)
             # or same lather & posts to multiple threads on the same day
-            if post_date.year < sotd_year or (post_date.month < sotd_month
-                    and post_date.year == sotd_year):
-                print('Complete.')
-                break
-            elif post_date.month != sotd_month or post_date.year != sotd_year:
-                print(f'Skipping thread {post.title}; wrong month.')
-                continue
             comment_count = 0
-            comments = get_cached_comments(post.id, post_date)
+            comments = get_cached_comments(post.id, post.post_date)
             if not comments:
-                ensure_loaded(post)
-                comments = post.comments
-                save_comments_to_cache(post.id, post_date, comments)
+                submission = reddit.submission(id=post.id)
+                ensure_loaded(submission)
+                comments = submission.comments
+                save_comments_to_cache(post.id, post.post_date, comments)
+                index.fetched(post.id, comments, submission.num_comments)
             post_proc_count += 1
             for cmt in comments:
                 comment_count += 1
-                scanner.scanComment(cmt, post_date, dataFile, arg_delimiter)
+                scanner.scanComment(cmt, post.post_date, dataFile, arg_delimiter)
             print(f"Processed {comment_count} comments in {post.title}.")
+
+    for pending in fetching:
+        merge_fetched(index, *pending)
+    cache.save_manifest(release=True)
+    index.close()
+    print(f"Saw {post_count} posts on Reddit and {len(posts)} SOTD posts in the index, processed {post_proc_count}.")
+
+
+def merge_fetched( index: fetch.PostIndex, post: fetch.IndexedPost, comments: list, future ):
+    """ Waits for the post to be fetched, then saves its comments to the cache,
+        merged into the cached comments if there are any.
+    """
+    fetched, fetched_comments, elapsed = future.result()
+    post_date = post.post_date
+    if comments:
+        added, edited, deleted = update_cache_comments(comments, fetched_comments)
+        if deleted:
+            print(f"{deleted} cached comments in {post.title} are deleted on Reddit; keeping them.")
+        if added or edited:
+            print(f"Found {len(added)} new and {len(edited)} edited comments in {post.title}"
+                    f" (fetched in {elapsed:.2f} s).")
+            save_comments_to_cache(post.id, post_date, comments, added, edited)
         else:
-            raise SystemExit(f"Unknown mode '{mode}'")
+            print(f"Loaded cache for {post.title} (fetched in {elapsed:.2f} s).")
+    else:
+        comments = fetched_comments
+        save_comments_to_cache(post.id, post_date, comments)
+        print(f"Saved {len(comments)} comments from {post.title} (fetched in {elapsed:.2f} s).")
+    index.fetched(post.id, comments, fetched.num_comments)
 
-    print(f"Saw {post_count} posts, processed {post_proc_count}.")
+
+def store_from_file():
+    """ Copies every post in the file cache into the SQLite comment store.
+    """
+    store = cache.CommentStore(cache.store_filename)
+    post_count = 0
+    comment_count = 0
+    for fp, post_id, post_date in cached_files(month_only = False):
+        comments = get_cached_comments(post_id, post_date)
+        if comments is None:
+            print(f"ERROR: failed to load comments from '{fp}'")
+            continue
+        store.save_comments(post_id, post_date, comments)
+        post_count += 1
+        comment_count += len(comments)
+    store.close()
+    print(f"Stored {comment_count} comments from {post_count} files in {cache.store_filename}.")
 
 
-# credentials & agent read from praw.ini
-reddit = praw.Reddit(site_name='SOTDScanner')
-wssub = reddit.subreddit('Wetshaving')
+def pack_from_file():
+    """ Writes every post in the file cache to the packed corpus.
+    """
+    counts = [ 0, 0 ]
+
+    def posts( ):
+        # one post in memory at a time
+        for fp, post_id, post_date in cached_files(month_only = False):
+            comments = get_cached_comments(post_id, post_date)
+            if comments is None:
+                print(f"ERROR: failed to load comments from '{fp}'")
+                continue
+            counts[0] += 1
+            counts[1] += len(comments)
+            yield post_id, post_date, comments
+
+    pack.write_pack(pack.pack_filename, posts())
+    print(f"Packed {counts[1]} comments from {counts[0]} files in {pack.pack_filename}.")
+
+
+def convert_files():
+    """ Rewrites every post in the file cache in the cache format, replacing
+        its file in any other format.
+    """
+    post_count = 0
+    old_size = 0
+    new_size = 0
+    for fp, post_id, post_date in cached_files(month_only = False):
+        filename = Path(cache.cache_filename(post_id, post_date, cache.cache_format))
+        if fp.name == filename.name:
+            continue
+        comments = get_cached_comments(post_id, post_date)
+        if comments is None:
+            print(f"ERROR: failed to load comments from '{fp}'")
+            continue
+        old_size += fp.stat().st_size
+        save_comments_to_cache(post_id, post_date, comments)
+        new_size += filename.stat().st_size
+        post_count += 1
+    print(f"Converted {post_count} files to {cache.cache_format}: {old_size / 1024:.1f} KiB"
+            f" became {new_size / 1024:.1f} KiB.")
+
+
+# while set, a signal to stop is held until it is cleared
+stop_held = None
+
+def stop_stream( signum, frame ):
+    """ Stops the stream on Ctrl-C or SIGTERM, unless it is held.
+    """
+    global stop_held
+    if stop_held is None:
+        raise KeyboardInterrupt
+    stop_held = True
+
+
+@contextlib.contextmanager
+def stop_deferred( ):
+    """ Holds any signal to stop the stream until the block is done.
+    """
+    global stop_held
+    stop_held = False
+    try:
+        yield
+    finally:
+        stopped = stop_held
+        stop_held = None
+    if stopped:
+        raise KeyboardInterrupt
+
+
+def stream_comments( reddit: 'praw.Reddit' ):
+    """ Follows the subreddit's comment stream until stopped, saving each new
+        top-level comment on a SOTD post to the cache as it is made, and
+        appending its scan to the stream CSV file for the post's month.  Only
+        the latest posts' comments are kept in memory, to tell which comments
+        are already saved.  The checkpoint, and the cache manifest, which is
+        kept open meanwhile, are saved whenever the stream is caught up, every
+        hundred comments, and when it stops.
+    """
+    from prawcore.exceptions import RequestException, ServerError, TooManyRequests
+    index = fetch.PostIndex()
+    threads = fetch.SotdThreads(reddit, index)
+    checkpoint = fetch.StreamCheckpoint()
+    cache.keep_manifest()
+    # post ID: ( the post's comments, as cached, and the set of their IDs )
+    posts = common.LRUCache(8)
+    counts = { 'read': 0, 'saved': 0 }
+    first = True
+    try:
+        while True:
+            try:
+                for cmt in reddit.subreddit('Wetshaving').stream.comments(pause_after=0):
+                    if cmt is None:
+                        # caught up, until more comments are made
+                        cache.save_manifest()
+                        checkpoint.save()
+                        continue
+                    if (first and checkpoint.resumed_from is not None
+                            and cmt.created_utc > checkpoint.resumed_from):
+                        # Reddit lists only the latest comments, and none made
+                        # before the stream stopped were among them
+                        print("WARNING: comments made while the stream was stopped may have been missed;"
+                                " run an incremental update to fetch them.")
+                    first = False
+                    counts['read'] += 1
+                    if counts['read'] % 100 == 0:
+                        cache.save_manifest()
+                        checkpoint.save()
+                    if checkpoint.seen(cmt) or cmt.parent_id != cmt.link_id:
+                        continue
+                    post_date = threads.post_date(cmt)
+                    if not post_date:
+                        continue
+                    post_id = cmt.link_id.partition('_')[2]
+                    cached = posts.get(post_id)
+                    if cached is None:
+                        comments = get_cached_comments(post_id, post_date) or [ ]
+                        cached = ( comments, set(cc.id for cc in comments) )
+                        posts.put(post_id, cached)
+                    comments, ids = cached
+                    if cmt.id in ids:
+                        continue
+                    comments.append(cmt)
+                    ids.add(cmt.id)
+                    with stop_deferred():
+                        # both or neither, or a restart would see the comment
+                        # as saved and never scan it
+                        save_comments_to_cache(post_id, post_date, comments, [ cmt ])
+                        filename = 'sotd-stream-{:0>4}-{:0>2}.csv'.format(post_date.year, post_date.month)
+                        with open(file=filename, mode='a', encoding='utf8') as dataFile:
+                            if dataFile.tell() == 0:
+                                write_headers(dataFile)
+                            scanner.scanComment(cmt, post_date, dataFile, arg_delimiter)
+                    counts['saved'] += 1
+                    print(f"Saved comment {cmt.id} by {cmt.author} on the {post_date} post.", flush=True)
+            except (RequestException, ServerError, TooManyRequests) as e:
+                # praw has already retried; wait, then start following the
+                # stream again, which reads the latest comments once more
+                print(f"Reddit request failed, retrying in 30 s: {e}", flush=True)
+                time.sleep(30)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cache.save_manifest(release=True)
+        checkpoint.save()
+        index.close()
+    print(f"Read {counts['read']} comments and saved {counts['saved']}; looked up {threads.fetched} posts"
+            f" on Reddit; threads {threads.threads.summary()}; posts {posts.summary()}.")
+
+
+# the RateLimiter every Reddit client shares
+limiter = None
+
+def connect( ):
+    """ Returns a Reddit client.  praw is only imported here, so compiling
+        from the file cache never loads it.
+    """
+    global limiter
+    import praw
+    if limiter is None:
+        # let up to ten seconds of requests through at once
+        limiter = fetch.RateLimiter(args.rate / 60, max(1, int(args.rate / 6)))
+    if args.reddit_url:
+        # a stand-in such as replay.py, which takes any credentials
+        return praw.Reddit(client_id='replay', client_secret='replay', user_agent='SOTDScanner replay',
+                oauth_url=args.reddit_url, reddit_url=args.reddit_url,
+                requestor_class=fetch.limited_requestor(limiter))
+    # credentials & agent read from praw.ini
+    return praw.Reddit(site_name='SOTDScanner', requestor_class=fetch.limited_requestor(limiter))
+
 
 if arg_mode is Mode.COMPILE:
     with open(file='sotd-{:0>4}-{:0>2}.csv'.format(sotd_year, sotd_month),
             mode='w', encoding='utf8') as dataFile:
-        # TODO put this together with scanner.scanComment(...)
-        headers = [ 'Date', 'Time', 'Author', 'Maker', 'Scent', 'Confidence',
-                'Lather', 'ID', 'Plaintext', 'URL' ]
-        if arg_delimiter == ',':
-            dataFile.write('"')
-        for i in range(len(headers)):
-            if arg_delimiter == '\t' and i >= 8:
-                continue
-            if i > 0:
-                if arg_delimiter == ',':
-                    dataFile.write('","')
-                else:
-                    dataFile.write(arg_delimiter)
-            dataFile.write(headers[i])
-        if arg_delimiter == ',':
-            dataFile.write('"')
-        dataFile.write('\n')
-        # end TODO
+        write_headers(dataFile)
+        if not args.no_memo:
+            scanner.lather_memo = memo.LatherMemo('lather-memo.db', scanner.fingerprint())
+            scanner.scan_store = memo.ScanStore('scan-store.db', scanner.fingerprint())
         if args.live:
-            do_the_work(wssub, arg_mode)
+            do_the_work(connect(), arg_mode)
         else:
             comp_from_file()
+    print(f"Scent match cache: {scents.match_cache_summary()}")
+    if scanner.lather_memo:
+        scanner.lather_memo.close()
+        print(f"Lather memo: {scanner.lather_memo.summary()}")
+    if scanner.scan_store:
+        scanner.scan_store.close()
+        print(f"Scan store: {scanner.scan_store.summary()}")
 elif arg_mode is Mode.INCREMENTAL:
-    do_the_work(wssub, arg_mode)
+    reddit = connect()
+    scheduler = fetch.FetchScheduler(connect, ensure_loaded, args.fetchers, limiter)
+    try:
+        do_the_work(reddit, arg_mode, scheduler)
+    finally:
+        scheduler.close()
+    print(f"Fetching: {scheduler.summary()}")
 elif arg_mode is Mode.ONE:
-    post = reddit.submission(id=args.id)
+    from prawcore.exceptions import NotFound
+    post = connect().submission(id=args.id)
     if post:
         try:
             # copied from do_the_work
             ensure_loaded(post)
             save_comments_to_cache(post.id, arg_date, post.comments)
             print(f"Saved {len(post.comments)} comments from {post.title}.")
+            index = fetch.PostIndex()
+            index.add(post, arg_date)
+            index.fetched(post.id, post.comments, post.num_comments)
+            index.close()
         except NotFound as e:
             print("The post was not found: " + str(e))
     else:
         print(f"No post found for {args.post_id}")
+elif arg_mode is Mode.STORE:
+    store_from_file()
+elif arg_mode is Mode.PACK:
+    pack_from_file()
+elif arg_mode is Mode.CONVERT:
+    convert_files()
+elif arg_mode is Mode.STREAM:
+    # stopped either way, the checkpoint is saved
+    signal.signal(signal.SIGINT, stop_stream)
+    signal.signal(signal.SIGTERM, stop_stream)
+    print("Following the comment stream; Ctrl-C to stop.", flush=True)
+    stream_comments(connect())
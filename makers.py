@@ -2,6 +2,8 @@
 
 import re
 
+from common import LiteralScanner, OrderedAlternation, required_literals
+
 _any_and = '\\s*(?:&(?:amp;|)|and|\\+|/|×|x|X|-|%)\\s*'
 _apostrophe = '(?:\'|&#39;|’|)'
 _opt_company = '\\s*(?:company|co\\.?|)\\s*'
@@ -983,9 +985,17 @@ _compiled_pats = None
 _compiled_hw = None
 _compiled_other = None
 _compiled_abbrev = None
+_combined_pats = None
+_combined_hw = None
+_combined_other = None
+_combined_abbrev = None
+_literal_patterns = None
+_unfiltered = None
+_literal_scanner = None
 
 def _compile():
     global _compiled_pats, _compiled_abbrev, _compiled_hw, _compiled_other
+    global _combined_pats, _combined_abbrev, _combined_hw, _combined_other
     if _compiled_pats is None:
         _compiled_pats = { }
         for pattern in _maker_pats:
@@ -999,6 +1009,55 @@ def _compile():
         _compiled_abbrev = { }
         for pattern in _abbrev_pats:
             _compiled_abbrev[re.compile('\\b' + pattern + '\\b' + _ending, re.IGNORECASE)] = _abbrev_pats[pattern]
+        _combined_pats = OrderedAlternation(list(_compiled_pats))
+        _combined_hw = OrderedAlternation(list(_compiled_hw))
+        _combined_other = OrderedAlternation(list(_compiled_other))
+        _combined_abbrev = OrderedAlternation(list(_compiled_abbrev))
+
+
+def _index_literals( ):
+    """ Builds the searchMaker() prefilter: the literals each pattern
+        requires, and a scanner for them.  Only searches need it, so it is
+        built on the first one rather than by _compile().
+    """
+    global _literal_patterns, _unfiltered, _literal_scanner
+    if _literal_scanner is not None:
+        return
+    _compile()
+    # very short literals are found almost everywhere, so they are skipped
+    _literal_patterns = { }
+    _unfiltered = set()
+    for pat_dict in ( _compiled_pats, _compiled_hw, _compiled_other, _compiled_abbrev ):
+        for pattern in pat_dict:
+            literals = required_literals(pattern)
+            if not literals or min(len(literal) for literal in literals) < 3:
+                _unfiltered.add(pattern)
+                continue
+            for literal in literals:
+                if literal not in _literal_patterns:
+                    _literal_patterns[literal] = [ ]
+                _literal_patterns[literal].append(pattern)
+    _literal_scanner = LiteralScanner(_literal_patterns)
+
+
+def precompile( ):
+    """ Compiles the patterns and every part of their alternations now,
+        rather than on first use.
+    """
+    _compile()
+    _index_literals()
+    for alternation in ( _combined_pats, _combined_hw, _combined_other, _combined_abbrev ):
+        alternation.compile_all()
+
+
+def _candidates( text: str ):
+    """ Returns the set of compiled patterns that may be found in the text,
+        based on the literals they require.
+    """
+    candidates = set(_unfiltered)
+    for literal in _literal_scanner.scan(text):
+        candidates.update(_literal_patterns[literal])
+    return candidates
 
 
 def matchMaker( text ):
@@ -1008,6 +1067,40 @@ def matchMaker( text ):
         Otherwise, None is returned.
     """
     _compile()
+    # Python alternation is ordered, so the combined pattern picks the same
+    # winner as trying each pattern in turn.  The winning pattern is matched
+    # again on its own so callers still get its match object and group(1).
+    index = _combined_pats.match(text)
+    if index >= 0:
+        pattern = _combined_pats.patterns[index]
+        return { 'match': pattern.match(text), 'name': _compiled_pats[pattern], 'abbreviated': False }
+    saved_full_hw = None
+    index = _combined_hw.match(text)
+    if index >= 0:
+        # longest hardware match wins, so the rest of the tier still counts
+        for pattern in _combined_hw.patterns[index:]:
+            result = pattern.match(text)
+            if result and (not saved_full_hw or (result.end() - result.start() >
+                    saved_full_hw['match'].end() - saved_full_hw['match'].start())):
+                saved_full_hw = { 'match': result, 'name': _compiled_hw[pattern], 'abbreviated': False }
+    index = _combined_other.match(text)
+    if index >= 0:
+        pattern = _combined_other.patterns[index]
+        return { 'match': pattern.match(text), 'name': _compiled_other[pattern], 'abbreviated': False }
+    # every match here starts at 0, so a hardware match hides all abbreviations
+    if not saved_full_hw:
+        index = _combined_abbrev.match(text)
+        if index >= 0:
+            pattern = _combined_abbrev.patterns[index]
+            return { 'match': pattern.match(text), 'name': _compiled_abbrev[pattern], 'abbreviated': True }
+    return saved_full_hw
+
+
+def _matchMakerSerial( text ):
+    """ The original pattern-by-pattern implementation of matchMaker(), kept
+        to check the combined patterns against (see check.py).
+    """
+    _compile()
     for pattern in _compiled_pats:
         result = pattern.match(text)
         if result:
@@ -1031,7 +1124,7 @@ def matchMaker( text ):
     return saved_full_hw
 
 
-def searchMaker( text: str ):
+def searchMaker( text: str, prefilter: bool = True ):
     """ Searches for a maker through the entire provided text. Will preferably
         return a match at the beginning of a line (less non-alphanumeric
         chars). But will also return a match in the middle of a line. Returns
@@ -1040,6 +1133,8 @@ def searchMaker( text: str ):
             'name': the standard maker name
             'first': boolean value indicating if the match is the first word on a line
             'abbreviated': boolean value indicating an abbreviation match instead of a spelled out maker name
+        With prefilter, the text is scanned once for the literals each pattern
+        requires, and only patterns whose literals are present are searched.
     """
     # TODO we have a real problem with Noble Otter's abbreviation matching the word "no"
     # this might also be a problem with other two or three letter abbreviations
@@ -1047,18 +1142,22 @@ def searchMaker( text: str ):
     saved_full_hw = None
     rpos = len(text)
     multiline = text.find("\n") >= 0
+    candidates = None
+    if prefilter:
+        _index_literals()
+        candidates = _candidates(text)
 
-    result = _subSearch(text, _compiled_pats)
+    result = _subSearch(text, _compiled_pats, candidates)
     if result:
         rpos = result['match'].start()
     if not result:
-        saved_full_hw = _subSearch(text, _compiled_hw)
-        next_rs = _subSearch(text, _compiled_other)
+        saved_full_hw = _subSearch(text, _compiled_hw, candidates)
+        next_rs = _subSearch(text, _compiled_other, candidates)
         if next_rs and next_rs['match'].start() < rpos:
             result = next_rs
             rpos = result['match'].start()
         if not result or multiline:
-            next_rs = _subSearch(text, _compiled_abbrev)
+            next_rs = _subSearch(text, _compiled_abbrev, candidates)
             if next_rs and next_rs['match'].start() < rpos:
                 result = next_rs
                 rpos = result['match'].start()
@@ -1071,11 +1170,16 @@ def searchMaker( text: str ):
         return saved_full_hw
 
 
-def _subSearch( text: str, pat_dict: dict ):
+def _subSearch( text: str, pat_dict: dict, candidates: set = None ):
+    """ Searches the text with each pattern in the dict, or only those in the
+        candidates set if one is given.
+    """
     best_match = None
     best_pos = len(text)
     best_begins_line = False
     for pattern in pat_dict:
+        if candidates is not None and pattern not in candidates:
+            continue
         result = pattern.search(text)
         if result:
             begin_line = False
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import hashlib
+import sqlite3
+
+
+class LatherMemo:
+    """ Stores the results of scanning lather lines in a SQLite file, so lines
+        repeated day after day are only scanned once.  Entries are keyed by the
+        line and the fingerprint of the scanning code used to scan it; entries
+        with any other fingerprint are dropped when the memo is opened.
+    """
+
+    def __init__( self, filename: str, fingerprint: str ):
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self.pending = [ ]
+        self.db = sqlite3.connect(filename)
+        self.db.execute('''create table if not exists lather_memo (
+                fingerprint text not null
+                , line text not null
+                , lather text
+                , maker text
+                , scent text
+                , confidence int not null
+                , context text not null
+                , kind text not null
+                , primary key (fingerprint, line)
+                )''')
+        self.db.execute('delete from lather_memo where fingerprint <> ?', ( fingerprint, ))
+        self.db.commit()
+        self.entries = { }
+        for row in self.db.execute('select line, lather, maker, scent, confidence, context, kind'
+                ' from lather_memo'):
+            self.entries[row[0]] = row[1:]
+
+
+    def get( self, line: str ):
+        """ Returns (lather, maker, scent, confidence, context, kind) for the line,
+            or None if it has not been scanned with the current patterns.
+        """
+        entry = self.entries.get(line)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+
+    def put( self, line: str, entry: tuple ):
+        self.entries[line] = entry
+        self.pending.append(( self.fingerprint, line ) + entry)
+
+
+    def close( self ):
+        if self.pending:
+            self.db.executemany('insert or replace into lather_memo values (?, ?, ?, ?, ?, ?, ?, ?)',
+                    self.pending)
+            self.db.commit()
+            self.pending = [ ]
+        self.db.close()
+
+
+    def take( self ):
+        """ Returns and clears the counts and new entries since the last take(),
+            so a worker process can pass them back to the memo in its parent.
+        """
+        taken = ( self.hits, self.misses, self.pending )
+        self.hits = 0
+        self.misses = 0
+        self.pending = [ ]
+        return taken
+
+
+    def add( self, taken: tuple ):
+        """ Adds counts and entries returned by take() in a worker process.
+        """
+        hits, misses, pending = taken
+        self.hits += hits
+        self.misses += misses
+        for row in pending:
+            self.entries[row[1]] = row[2:]
+        self.pending += pending
+
+
+    def summary( self ):
+        return f"{self.hits} hits, {self.misses} misses ({len(self.entries)} lines stored)"
+
+
+def body_hash( body: str, body_html: str ):
+    """ Identifies a comment's text; changes when the comment is edited.
+    """
+    digest = hashlib.sha1(body.encode('utf8'))
+    digest.update(b'\0')
+    digest.update(body_html.encode('utf8'))
+    return digest.hexdigest()
+
+
+class ScanStore:
+    """ Stores the scan result for each comment in a SQLite file, so a compile
+        only rescans comments which are new, have been edited, or were scanned
+        with different scanning code.
+    """
+
+    def __init__( self, filename: str, fingerprint: str ):
+        self.fingerprint = fingerprint
+        self.reused = 0
+        self.new = 0
+        self.edited = 0
+        self.changed = 0
+        self.pending = [ ]
+        self.db = sqlite3.connect(filename)
+        self.db.execute('''create table if not exists scan_result (
+                comment_id text not null
+                , body_hash text not null
+                , fingerprint text not null
+                , lather text
+                , maker text
+                , scent text
+                , confidence int not null
+                , context text not null
+                , primary key (comment_id)
+                )''')
+        # read up front, so worker processes never use the connection
+        self.rows = { }
+        for row in self.db.execute('select comment_id, body_hash, fingerprint, lather, maker, scent,'
+                ' confidence, context from scan_result'):
+            self.rows[row[0]] = row[1:]
+
+
+    def get( self, comment_id: str, body_hash: str ):
+        """ Returns (lather, maker, scent, confidence, context) for the comment,
+            or None if it needs to be scanned.
+        """
+        row = self.rows.get(comment_id)
+        if row is None:
+            self.new += 1
+        elif row[0] != body_hash:
+            self.edited += 1
+        elif row[1] != self.fingerprint:
+            self.changed += 1
+        else:
+            self.reused += 1
+            return row[2:]
+        return None
+
+
+    def put( self, comment_id: str, body_hash: str, entry: tuple ):
+        row = ( comment_id, body_hash, self.fingerprint ) + entry
+        self.rows[comment_id] = row[1:]
+        self.pending.append(row)
+
+
+    def close( self ):
+        if self.pending:
+            self.db.executemany('insert or replace into scan_result values (?, ?, ?, ?, ?, ?, ?, ?)',
+                    self.pending)
+            self.db.commit()
+            self.pending = [ ]
+        self.db.close()
+
+
+    def take( self ):
+        """ Returns and clears the counts and new rows since the last take(),
+            so a worker process can pass them back to the store in its parent.
+        """
+        taken = ( self.reused, self.new, self.edited, self.changed, self.pending )
+        self.reused = 0
+        self.new = 0
+        self.edited = 0
+        self.changed = 0
+        self.pending = [ ]
+        return taken
+
+
+    def add( self, taken: tuple ):
+        """ Adds counts and rows returned by take() in a worker process.
+        """
+        reused, new, edited, changed, pending = taken
+        self.reused += reused
+        self.new += new
+        self.edited += edited
+        self.changed += changed
+        for row in pending:
+            self.rows[row[0]] = row[1:]
+        self.pending += pending
+
+
+    def summary( self ):
+        rescanned = self.new + self.edited + self.changed
+        return (f"{rescanned} comments rescanned ({self.new} new, {self.edited} edited,"
+                f" {self.changed} with changed patterns), {self.reused} reused")
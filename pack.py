@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+import struct
+from datetime import date
+
+from cache import CachedComment
+
+pack_filename = 'postdata.pack'
+
+# The file starts with the header, then the comment records, the post table
+# and the comment offset table.  A comment record is its numbers, the size of
+# its text and a mask of its missing strings, then the text: the strings
+# separated by NUL characters, as UTF-8, so it is decoded and split in one go.
+# A post entry is its two strings, each UTF-8 with a length prefix, followed
+# by the index of its first comment and its comment count.
+_magic = b'SOTDPAK1'
+# magic, post count, comment count, post table offset, offset table offset
+_header = struct.Struct('<8sIIQQ')
+# created_utc, edited (0 if not), score, flags, text size in bytes, and the
+# mask of strings which are None
+_numbers = struct.Struct('<ddqBIB')
+_saved_flag = 1
+_score_flag = 2
+_length = struct.Struct('<I')
+_no_string = 0xFFFFFFFF
+_post_counts = struct.Struct('<II')
+_offset = struct.Struct('<Q')
+
+# strings in each comment record, in order
+_string_fields = ( 'id', 'author', 'body', 'body_html', 'permalink', 'link_id', 'parent_id',
+        'subreddit_id' )
+
+
+def _pack_string( text: str ):
+    if text is None:
+        return _length.pack(_no_string)
+    data = text.encode('utf8')
+    return _length.pack(len(data)) + data
+
+
+def write_pack( filename: str, posts ):
+    """ Writes a packed corpus of the given ( post ID, post date, comments )
+        posts, where the comments are CachedComment records.
+    """
+    temp_name = filename + '.tmp'
+    post_table = [ ]
+    offsets = [ ]
+    with open(file = temp_name, mode = 'wb') as pack_file:
+        pack_file.write(_header.pack(_magic, 0, 0, 0, 0))
+        for post_id, post_date, comments in posts:
+            first = len(offsets)
+            for cmt in comments:
+                offsets.append(pack_file.tell())
+                flags = _saved_flag if cmt.saved else 0
+                if cmt.score is not None:
+                    flags |= _score_flag
+                author = cmt.author.name if cmt.author else None
+                strings = [ author if field == 'author' else getattr(cmt, field)
+                        for field in _string_fields ]
+                missing = 0
+                for i in range(len(strings)):
+                    if strings[i] is None:
+                        missing |= 1 << i
+                        strings[i] = ''
+                    elif '\0' in strings[i]:
+                        raise ValueError(f"Comment {cmt.id} has a NUL character, which cannot be packed")
+                text = '\0'.join(strings).encode('utf8')
+                pack_file.write(_numbers.pack(cmt.created_utc, cmt.edited or 0, cmt.score or 0, flags,
+                        len(text), missing))
+                pack_file.write(text)
+            post_table.append(_pack_string(post_id) + _pack_string(post_date.isoformat())
+                    + _post_counts.pack(first, len(offsets) - first))
+        posts_at = pack_file.tell()
+        pack_file.write(b''.join(post_table))
+        offsets_at = pack_file.tell()
+        pack_file.write(b''.join(_offset.pack(offset) for offset in offsets))
+        pack_file.seek(0)
+        pack_file.write(_header.pack(_magic, len(post_table), len(offsets), posts_at, offsets_at))
+    os.replace(temp_name, filename)
+
+
+class PackedCorpus:
+    """ Reads a packed corpus through mmap, so processes forked after it is
+        opened share the same pages.  Comments are decoded only when asked for.
+    """
+
+    def __init__( self, filename: str = pack_filename ):
+        with open(file = filename, mode = 'rb') as pack_file:
+            self.map = mmap.mmap(pack_file.fileno(), 0, access = mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, post_count, self.comment_count, posts_at, self.offsets_at = _header.unpack_from(self.map)
+        if magic != _magic:
+            raise ValueError(f"{filename} is not a packed corpus")
+        # ( post ID, post date, first comment index, comment count )
+        self.posts = [ ]
+        offset = posts_at
+        for i in range(post_count):
+            post_id, offset = self._string(offset)
+            post_date, offset = self._string(offset)
+            first, count = _post_counts.unpack_from(self.map, offset)
+            offset += _post_counts.size
+            self.posts.append(( post_id, date.fromisoformat(post_date), first, count ))
+
+
+    def _string( self, offset: int ):
+        """ Returns the string at the offset, and the offset after it.
+        """
+        length = _length.unpack_from(self.map, offset)[0]
+        offset += _length.size
+        if length == _no_string:
+            return None, offset
+        return str(self.view[offset:offset + length], 'utf8'), offset + length
+
+
+    def comment( self, index: int ):
+        """ Returns comment number index as a CachedComment.
+        """
+        offset = _offset.unpack_from(self.map, self.offsets_at + index * _offset.size)[0]
+        created_utc, edited, score, flags, size, missing = _numbers.unpack_from(self.map, offset)
+        offset += _numbers.size
+        data = dict(zip(_string_fields, str(self.view[offset:offset + size], 'utf8').split('\0')))
+        if missing:
+            for i in range(len(_string_fields)):
+                if missing & (1 << i):
+                    data[_string_fields[i]] = None
+        data['created_utc'] = created_utc
+        data['edited'] = edited or False
+        data['score'] = score if flags & _score_flag else None
+        data['saved'] = bool(flags & _saved_flag)
+        return CachedComment(data)
+
+
+    def month_posts( self, year: int, month: int ):
+        """ Returns ( post ID, post date ) for each post in the month.
+        """
+        return [ ( post_id, post_date ) for post_id, post_date, first, count in self.posts
+                if post_date.year == year and post_date.month == month ]
+
+
+    def iter_comments( self, post_id: str, post_date: date ):
+        for pid, pdate, first, count in self.posts:
+            if pid == post_id and pdate == post_date:
+                for index in range(first, first + count):
+                    yield self.comment(index)
+
+
+    def iter_all( self ):
+        for index in range(self.comment_count):
+            yield self.comment(index)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import random
+import signal
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cache
+
+aparser = argparse.ArgumentParser(description='Serve the file cache as a stand-in for the Reddit API')
+aparser.add_argument('--port', type=int, default=8765,
+        help='Specify the port to listen on (default 8765); main.py --reddit-url\n'
+        'http://127.0.0.1:8765 then fetches from it.')
+aparser.add_argument('--latency', type=float, default=0.1,
+        help='Specify the seconds each response is held back (default 0.1).')
+aparser.add_argument('--limit', type=int, default=1000,
+        help='Specify how many requests Reddit allows in each window (default 1000);\n'
+        'more are answered with 429 Too Many Requests.  praw spaces its requests\n'
+        'out to stay within the limit.')
+aparser.add_argument('--window', type=float, default=600,
+        help='Specify the rate limit window in seconds (default 600).')
+aparser.add_argument('--errors', type=float, default=0,
+        help='Specify the share of requests to fail with 503, to exercise retries.')
+aparser.add_argument('--initial', type=int, default=100,
+        help='Specify how many comments a post is fetched with; the rest are left\n'
+        'to be loaded as "more" comments, up to 100 a request (default 100).')
+aparser.add_argument('--days-ago', type=int,
+        help='Move the post dates so the newest was this many days ago, so incremental\n'
+        'mode finds them.')
+aparser.add_argument('--comment-rate', type=float, default=0,
+        help='Specify how many comments a second are made, for the subreddit comment\n'
+        'stream: it starts with the oldest 100 cached comments, and the rest follow\n'
+        'in the order made.  By default they are all there from the start.')
+args = aparser.parse_args()
+
+subreddit = 'Wetshaving'
+subreddit_id = 't5_2s5ea'
+
+
+class Post:
+    """ A cached post, as Reddit would list it.
+    """
+    __slots__ = ( 'id', 'post_date', 'title', 'created_utc', 'comment_count' )
+
+    def __init__( self, post_id: str, post_date: date, shown_date: date, comment_count: int ):
+        self.id = post_id
+        self.post_date = post_date
+        self.comment_count = comment_count
+        self.title = f"{shown_date:%A} SOTD Thread - {shown_date:%b %d, %Y}"
+        # posted at midnight US Central time
+        self.created_utc = datetime(shown_date.year, shown_date.month, shown_date.day, 6,
+                tzinfo = timezone.utc).timestamp()
+
+
+def load_posts( ):
+    """ Returns every post in the file cache, newest first, as listed.
+    """
+    manifest = cache.load_manifest()
+    counts = { ( entry['post_id'], entry['post_date'] ): entry['comments'] or 0
+            for entry in manifest.files.values() }
+    found = sorted(counts, key = lambda post: ( post[1], post[0] ), reverse = True)
+    if not found:
+        raise SystemExit('No posts found in postdata.')
+    shift = timedelta(0)
+    if args.days_ago is not None:
+        shift = date.today() - timedelta(days = args.days_ago) - date.fromisoformat(found[0][1])
+    return [ Post(post_id, date.fromisoformat(post_date), date.fromisoformat(post_date) + shift,
+            counts[( post_id, post_date )]) for post_id, post_date in found ]
+
+
+posts = load_posts()
+posts_by_id = { post.id: post for post in posts }
+
+
+def comment_thing( cmt: cache.CachedComment ):
+    data = cache._comment_map(cmt)
+    if not data['author']:
+        data['author'] = '[deleted]'
+    data.update({ 'name': f"t1_{cmt.id}", 'replies': '', 'depth': 0, 'subreddit': subreddit })
+    return { 'kind': 't1', 'data': data }
+
+
+def post_thing( post: Post, comment_count: int ):
+    return { 'kind': 't3', 'data': { 'id': post.id, 'name': f"t3_{post.id}", 'title': post.title,
+            'created_utc': post.created_utc, 'num_comments': comment_count, 'author': 'AutoModerator',
+            'permalink': f"/r/{subreddit}/comments/{post.id}/", 'subreddit': subreddit,
+            'subreddit_id': subreddit_id, 'url': f"https://www.reddit.com/r/{subreddit}/comments/{post.id}/",
+            'is_self': True, 'selftext': '', 'selftext_html': None } }
+
+
+def listing( children: list, after: str = None ):
+    return { 'kind': 'Listing', 'data': { 'after': after, 'before': None, 'dist': len(children),
+            'children': children } }
+
+
+class CommentStream:
+    """ The subreddit's comments, newest first, as made over time at the
+        comment rate.
+    """
+
+    def __init__( self ):
+        self.lock = threading.Lock()
+        self.comments = None
+        self.started = time.time()
+
+
+    def made( self ):
+        """ Returns the comments made so far, oldest first.
+        """
+        with self.lock:
+            if self.comments is None:
+                self.comments = sorted(( cmt for post in posts
+                        for cmt in cache.get_cached_comments(post.id, post.post_date) or [ ] ),
+                        key = lambda cmt: cmt.created_utc)
+        if args.comment_rate <= 0:
+            return self.comments
+        return self.comments[0:100 + int((time.time() - self.started) * args.comment_rate)]
+
+
+    def page( self, params: dict ):
+        """ Returns the newest comments, or with before, those made just after
+            that one.
+        """
+        made = self.made()
+        limit = min(int(params.get('limit', 25)), 100)
+        if params.get('before'):
+            names = [ f"t1_{cmt.id}" for cmt in made ]
+            if params['before'] not in names:
+                return listing([ ])
+            start = names.index(params['before']) + 1
+            shown = made[start:start + limit]
+        else:
+            shown = made[-limit:]
+        return listing([ comment_thing(cmt) for cmt in reversed(shown) ])
+
+
+comment_stream = CommentStream()
+
+
+def more_things( post: Post, ids: list ):
+    """ Returns "more" things for the IDs, up to 100 each, as Reddit gives them.
+    """
+    return [ { 'kind': 'more', 'data': { 'count': len(ids[i:i + 100]), 'name': 't1__', 'id': '_',
+            'parent_id': f"t3_{post.id}", 'depth': 0, 'children': ids[i:i + 100] } }
+            for i in range(0, len(ids), 100) ]
+
+
+def page( listed: list, params: dict ):
+    """ Returns the page of the listed posts that the limit and after
+        parameters ask for; nothing if after is not listed.
+    """
+    limit = min(int(params.get('limit', 25)), 100)
+    start = 0
+    if params.get('after'):
+        names = [ f"t3_{post.id}" for post in listed ]
+        if params['after'] not in names:
+            return listing([ ])
+        start = names.index(params['after']) + 1
+    shown = listed[start:start + limit]
+    after = f"t3_{shown[-1].id}" if shown and start + limit < len(listed) else None
+    return listing([ post_thing(post, post.comment_count) for post in shown ], after)
+
+
+def search( params: dict ):
+    """ Finds the posts with every word of the query in their titles, as
+        Reddit does for title:word terms.
+    """
+    words = [ word.partition(':')[2] if word.startswith('title:') else word
+            for word in params.get('q', '').lower().replace('"', '').split() ]
+    return page([ post for post in posts if all(word in post.title.lower() for word in words) ], params)
+
+
+def submission( post_id: str, params: dict ):
+    post = posts_by_id.get(post_id)
+    if post is None:
+        return None
+    comments = cache.get_cached_comments(post.id, post.post_date) or [ ]
+    if params.get('sort') == 'new':
+        comments.sort(key = lambda cmt: cmt.created_utc, reverse = True)
+    initial = min(int(params.get('limit', args.initial)), args.initial)
+    shown = [ comment_thing(cmt) for cmt in comments[0:initial] ]
+    more = more_things(post, [ cmt.id for cmt in comments[initial:] ])
+    return [ listing([ post_thing(post, len(comments)) ]), listing(shown + more) ]
+
+
+def morechildren( params: dict ):
+    post = posts_by_id.get(params.get('link_id', '')[3:])
+    if post is None:
+        return None
+    ids = set(params.get('children', '').split(','))
+    things = [ comment_thing(cmt) for cmt in cache.get_cached_comments(post.id, post.post_date) or [ ]
+            if cmt.id in ids ]
+    return { 'json': { 'errors': [ ], 'data': { 'things': things } } }
+
+
+class Limits:
+    """ Counts requests in Reddit's fixed windows, for its rate limit headers.
+    """
+
+    def __init__( self ):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.used = 0
+        self.counts = { }
+
+    def take( self, kind: str ):
+        """ Counts a request, returning ( remaining, seconds to reset ), with
+            remaining below zero once the limit is passed.
+        """
+        with self.lock:
+            now = time.time()
+            if now - self.started >= args.window:
+                self.started = now
+                self.used = 0
+            self.used += 1
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            return args.limit - self.used, args.window - (now - self.started)
+
+    def summary( self ):
+        return ', '.join(f"{count} {kind}" for kind, count in sorted(self.counts.items()))
+
+
+limits = Limits()
+
+
+class Handler( BaseHTTPRequestHandler ):
+    protocol_version = 'HTTP/1.1'
+    # send the headers and body together, not in separate packets
+    wbufsize = -1
+
+    def do_GET( self ):
+        self.answer(parse_qs(urlparse(self.path).query))
+
+    def do_POST( self ):
+        params = parse_qs(urlparse(self.path).query)
+        length = int(self.headers.get('Content-Length', 0))
+        params.update(parse_qs(self.rfile.read(length).decode('utf8')))
+        self.answer(params)
+
+    def answer( self, params: dict ):
+        params = { name: values[-1] for name, values in params.items() }
+        path = urlparse(self.path).path.rstrip('/')
+        parts = path.split('/')
+        time.sleep(args.latency)
+        if path == '/api/v1/access_token':
+            # read-only application access; any credentials will do
+            self.send(200, { 'access_token': 'replay', 'token_type': 'bearer', 'expires_in': 86400,
+                    'scope': '*' })
+            return
+        kind = 'other'
+        if path in ( f"/r/{subreddit}/hot", f"/r/{subreddit}/new" ):
+            # both newest first, as the posts are one a day
+            kind = 'listing'
+        elif path == f"/r/{subreddit}/search":
+            kind = 'search'
+        elif path == f"/r/{subreddit}/comments":
+            kind = 'comments'
+        elif len(parts) >= 3 and parts[1] == 'comments':
+            kind = 'submission'
+        elif path == '/api/morechildren':
+            kind = 'morechildren'
+        remaining, reset = limits.take(kind)
+        headers = { 'x-ratelimit-used': str(args.limit - remaining),
+                'x-ratelimit-remaining': str(max(remaining, 0)), 'x-ratelimit-reset': str(int(reset)) }
+        if remaining < 0:
+            self.send(429, { 'message': 'Too Many Requests', 'error': 429 }, headers)
+        elif random.random() < args.errors:
+            self.send(503, { 'message': 'Service Unavailable', 'error': 503 }, headers)
+        elif kind == 'listing':
+            self.send(200, page(posts, params), headers)
+        elif kind == 'search':
+            self.send(200, search(params), headers)
+        elif kind == 'comments':
+            self.send(200, comment_stream.page(params), headers)
+        elif kind == 'submission':
+            self.send(200, submission(parts[2], params), headers)
+        elif kind == 'morechildren':
+            self.send(200, morechildren(params), headers)
+        else:
+            self.send(404, None, headers)
+
+    def send( self, status: int, body, headers: dict = { } ):
+        if body is None:
+            status = 404
+            body = { 'message': 'Not Found', 'error': 404 }
+        data = json.dumps(body).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message( self, format, *log_args ):
+        # one line a request would swamp the timings
+        pass
+
+
+server = ThreadingHTTPServer(( '127.0.0.1', args.port ), Handler)
+# stopped either way, the counts are printed
+signal.signal(signal.SIGTERM, signal.default_int_handler)
+print(f"Serving {len(posts)} posts at http://127.0.0.1:{args.port}; Ctrl-C to stop.", flush = True)
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+server.server_close()
+print(f"Answered {limits.summary()} requests.")
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
 import makers
+import memo
 import scents
-from common import strip_separators, separator_pattern
+from common import source_fingerprint, strip_separators, separator_pattern
 
 import datetime
 import re
@@ -45,6 +46,11 @@ ppat = re.compile('<\\s*p\\s*/?>', re.IGNORECASE)
 tagpat = re.compile('<[^>]*>')
 mnlpat = re.compile("\n\n+")
 
+# set to a memo.LatherMemo to reuse lather line results across runs
+lather_memo = None
+# set to a memo.ScanStore to reuse whole comment results across runs
+scan_store = None
+
 class LatherMatch:
     lather = ''
     maker = ''
@@ -60,6 +66,23 @@ class LatherMatch:
         return str(self.confidence) + '.' + self.context
 
 
+def fingerprint( ):
+    """ Identifies the code scan results depend on: the maker and scent
+        patterns and everything here which uses them, such as lather_pattern
+        and removeMarkdown().
+    """
+    return source_fingerprint('scanner', 'makers', 'scents', 'common')
+
+
+def precompile( ):
+    """ Compiles all maker and scent patterns, with their first character
+        tables and alternations, now rather than on first use, so processes
+        forked afterwards share them instead of each compiling its own.
+    """
+    makers.precompile()
+    scents.precompile()
+
+
 def get_sotd_date( post ):
     sotd_match = sotd_pattern.search(post.title)
     if not sotd_match:
@@ -132,7 +155,7 @@ def scanComment( tlc, post_date, dataFile, delimiter ):
             dateFile: the CSV output file (result of open())
             delimiter: the delimiter to use, comma ',' or tab '\\t'
     """
-    details = scanBody(tlc)
+    details = scanStored(tlc)
 
     author_name = None
     if tlc.author:
@@ -261,6 +284,113 @@ def cleanAndMatchScent( lather: LatherMatch ):
     return False
 
 
+def scanLatherLine( lather: LatherMatch, body: str ):
+    """ Matches the maker and scent in lather.lather, updating the LatherMatch.
+        Returns the kind of match for logging: 'Primary match', 'Scent-first match on'
+        or 'No match against'.  The body is only used when the lather line is empty.
+    """
+    # TODO match "N/A", "none", "nothing" ??
+    result = makers.matchMaker(lather.lather)
+    if result:
+        lather.maker = result['name']
+        lather.scent = result['match'].group(1)
+        lather.context += 'M'
+        if result['abbreviated']:
+            lather.confidence += 2
+        else:
+            lather.confidence += 3
+    else:
+        result = makers.searchMaker(lather.lather)
+        if result:
+            lather.maker = result['name']
+            lather.scent = result['match'].group(1)
+            if result['abbreviated']:
+                lather.context += 'O'
+                lather.confidence += 1
+            else:
+                lather.context += 'N'
+                lather.confidence += 2
+            pretext = lather.lather[0:result['match'].start()].strip()
+            result = by_pattern.match(pretext)
+            if result:
+                lather.scent = result.group(1)
+                lather.context += 'B'
+            elif not lather.scent:
+                lather.scent = pretext
+                lather.context += 'B'
+
+    if lather.scent:
+        cleanAndMatchScent(lather)
+    elif lather.maker and scents.isSingleScent(lather.maker):
+        lather.context += '1'
+        lather.confidence += 2
+        lather.scent = scents.getSingleScent(lather.maker)
+    elif lather.maker:
+        result = scents.match_scent(lather.maker, lather.scent)
+        if result:
+            lather.scent = result['scent']
+        else:
+            lather.confidence -= 1
+    else:
+        # TODO find a better place to do this
+        lather.lather = lather.lather.replace('&#39;', '\'').replace('&amp;', '&')
+        pos = lather.lather.find(' - ')
+        if pos < 0:
+            pos = lather.lather.find(' – ')
+        if pos > 0:
+            lather.maker = lather.lather[0:pos]
+            lather.scent = lather.lather[pos+3:]
+            # TODO should this use findany?
+            # I don't think so... if scent can be identified by findany, then
+            # how did we fail to match the maker?
+            # Answer: Chatillon Lux is not a known maker, but has known scents
+            cleanAndMatchScent(lather)
+        else:
+            result = separator_pattern.search(lather.lather)
+            if result:
+                lather.maker = lather.lather[0:result.start()]
+                lather.scent = scents.title_case(lather.lather[result.end():])
+            else:
+                # TODO needs to be more discriminating still?
+                result = scents.findAnyScent(lather.lather)
+                if result:
+                    lather.context += 'S'
+                    lather.maker = result['maker']
+                    lather.scent = result['scent']
+                else:
+                    lather.maker = lather.lather
+
+    if lather.maker:
+        return 'Primary match'
+    result = scentFirst(body, lather.lather)
+    if result:
+        lather.maker = result['maker']
+        lather.scent = result['scent']
+        lather.context += 'S'
+        # TODO confidence boost based on proportion of text matched?
+        lather.confidence += 2
+        return 'Scent-first match on'
+    return 'No match against'
+
+
+def scanStored( tlc ):
+    """ As scanBody(), but reuses the result in scan_store when the comment
+        is unchanged and was scanned with the current pattern tables.
+    """
+    if scan_store is None:
+        return scanBody(tlc)
+    body_hash = memo.body_hash(tlc.body, tlc.body_html)
+    entry = scan_store.get(tlc.id, body_hash)
+    if entry is None:
+        lather = scanBody(tlc)
+        scan_store.put(tlc.id, body_hash, ( lather.lather, lather.maker, lather.scent,
+                lather.confidence, lather.context ))
+    else:
+        lather = LatherMatch(body_html=tlc.body_html)
+        lather.lather, lather.maker, lather.scent, lather.confidence, lather.context = entry
+    return lather
+
+
 def scanBody( tlc, silent = False ):
     """ Always returns a LatherMatch object.
     """
@@ -283,90 +413,23 @@ def scanBody( tlc, silent = False ):
         lather.lather = lmr.group(1).strip()
         lather.context = 'L'
         lather.confidence += 3
-        # TODO match "N/A", "none", "nothing" ??
-        result = makers.matchMaker(lather.lather)
-        if result:
-            lather.maker = result['name']
-            lather.scent = result['match'].group(1)
-            lather.context += 'M'
-            if result['abbreviated']:
-                lather.confidence += 2
+        if lather_memo is not None and lather.lather:
+            line = lather.lather
+            start = lather.confidence
+            entry = lather_memo.get(line)
+            if entry is not None:
+                lather.lather, lather.maker, lather.scent, confidence, lather.context, kind = entry
+                lather.confidence = start + confidence
             else:
-                lather.confidence += 3
+                kind = scanLatherLine(lather, tlc.body)
+                lather_memo.put(line, ( lather.lather, lather.maker, lather.scent,
+                        lather.confidence - start, lather.context, kind ))
         else:
-            result = makers.searchMaker(lather.lather)
-            if result:
-                lather.maker = result['name']
-                lather.scent = result['match'].group(1)
-                if result['abbreviated']:
-                    lather.context += 'O'
-                    lather.confidence += 1
-                else:
-                    lather.context += 'N'
-                    lather.confidence += 2
-                pretext = lather.lather[0:result['match'].start()].strip()
-                result = by_pattern.match(pretext)
-                if result:
-                    lather.scent = result.group(1)
-                    lather.context += 'B'
-                elif not lather.scent:
-                    lather.scent = pretext
-                    lather.context += 'B'
-
-        if lather.scent:
-            cleanAndMatchScent(lather)
-        elif lather.maker and scents.isSingleScent(lather.maker):
-            lather.context += '1'
-            lather.confidence += 2
-            lather.scent = scents.getSingleScent(lather.maker)
-        elif lather.maker:
-            result = scents.match_scent(lather.maker, lather.scent)
-            if result:
-                lather.scent = result['scent']
-            else:
-                lather.confidence -= 1
-        else:
-            # TODO find a better place to do this
-            lather.lather = lather.lather.replace('&#39;', '\'').replace('&amp;', '&')
-            pos = lather.lather.find(' - ')
-            if pos < 0:
-                pos = lather.lather.find(' – ')
-            if pos > 0:
-                lather.maker = lather.lather[0:pos]
-                lather.scent = lather.lather[pos+3:]
-                # TODO should this use findany?
-                # I don't think so... if scent can be identified by findany, then
-                # how did we fail to match the maker?
-                # Answer: Chatillon Lux is not a known maker, but has known scents
-                cleanAndMatchScent(lather)
-            else:
-                result = separator_pattern.search(lather.lather)
-                if result:
-                    lather.maker = lather.lather[0:result.start()]
-                    lather.scent = scents.title_case(lather.lather[result.end():])
-                else:
-                    # TODO needs to be more discriminating still?
-                    result = scents.findAnyScent(lather.lather)
-                    if result:
-                        lather.context += 'S'
-                        lather.maker = result['maker']
-                        lather.scent = result['scent']
-                    else:
-                        lather.maker = lather.lather
-
+            kind = scanLatherLine(lather, tlc.body)
         if lather.maker:
-            print(f'Primary match "{lather.maker}" / "{lather.scent}" ({lather.getConfidenceText()}) in {tlc.id} by {tlc.author}')
+            print(f'{kind} "{lather.maker}" / "{lather.scent}" ({lather.getConfidenceText()}) in {tlc.id} by {tlc.author}')
         else:
-            result = scentFirst(tlc.body, lather.lather)
-            if result:
-                lather.maker = result['maker']
-                lather.scent = result['scent']
-                lather.context += 'S'
-                # TODO confidence boost based on proportion of text matched?
-                lather.confidence += 2
-                print(f'Scent-first match on "{lather.maker}" / "{lather.scent}" ({lather.getConfidenceText()}) in {tlc.id} by {tlc.author}')
-            else:
-                print(f'No match against "{lather.lather}" in {tlc.id} by {tlc.author}')
+            print(f'No match against "{lather.lather}" in {tlc.id} by {tlc.author}')
     else:
         result = makers.searchMaker(tlc.body)
         if result:
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
 import re
+from types import MappingProxyType
 
-from common import strip_separators, separator_pattern
+from common import LRUCache, LiteralScanner, OrderedAlternation, required_literals, strip_separators, separator_pattern
 
 type_suffix_pattern = re.compile('''\\s*\\(?(?:\\s*shav(?:ing|e)\\s+(?:soap|cream|puck)
         |\\s*(?:soap\\s*|)sampler?
@@ -22,6 +23,12 @@ _barbershop = 'bar?ber(?: *shop|)'
 
 _unique_names = { }
 _compiled_pats = None
+_literal_makers = None
+_unfiltered_makers = None
+_literal_scanner = None
+# match_scent() results, keyed by maker and scent text; _no_match marks a miss
+match_cache = LRUCache(8192)
+_no_match = object()
 
 def _default_custom( map ):
     return map
@@ -52,9 +59,13 @@ class Sniffer:
             bases: list = None, custom = None ):
         # TODO this is set in _compile_all(), so we can just use the map key
         self.makername = None
-        self.lowpatterns = { }
-        self.highpatterns = { }
-        self.bases = [ ]
+        # patterns are compiled on first use, see _compile()
+        self.lowpatterns = None
+        self.highpatterns = None
+        self.bases = None
+        self.scent_first = None
+        self.combined_low = None
+        self.sources = ( lowpatterns or { }, patterns or { }, bases or [ ] )
         self.namecount = 0
         if default_scent:
             self.default_scent = default_scent
@@ -64,22 +75,18 @@ class Sniffer:
             self.custom = custom
         else:
             self.custom = _default_custom
-        self._compile(lowpatterns, patterns, bases)
+        self._count_names()
 
 
-    def _compile( self, lowpatterns: dict, highpatterns: dict, bases: list ):
+    def _count_names( self ):
+        lowpatterns, highpatterns, bases = self.sources
         allnames = [ ]
-        if lowpatterns:
-            for pat in lowpatterns:
-                self.lowpatterns[comp_pattern(pat)] = lowpatterns[pat]
-                if lowpatterns[pat] not in allnames:
-                    allnames.append(lowpatterns[pat])
-        if highpatterns:
-            for pat in highpatterns:
-                finalpat = pat
-                self.highpatterns[comp_pattern(finalpat)] = highpatterns[pat]
-                if highpatterns[pat] not in allnames:
-                    allnames.append(highpatterns[pat])
+        for pat in lowpatterns:
+            if lowpatterns[pat] not in allnames:
+                allnames.append(lowpatterns[pat])
+        for pat in highpatterns:
+            if highpatterns[pat] not in allnames:
+                allnames.append(highpatterns[pat])
         self.namecount = len(allnames)
         if self.namecount == 0 and self.default_scent:
             self.namecount = 1
@@ -89,16 +96,52 @@ class Sniffer:
                 _unique_names[name] = 1
             else:
                 _unique_names[name] += 1
-        if bases:
-            for name in bases:
-                bpat = '\\b' + name + '(?:\\s+(?:base|formula)\\b|\\b)'
-                self.bases.append(re.compile(
-                        '\\s*(?:\\(' + bpat + '\\)|(?:\\bin |[:,\\-]\\s*)' + bpat
-                                + '|' + bpat + '\\s*[\\-\\:,]?)\\s*',
-                        re.IGNORECASE))
+
+
+    def _compile( self ):
+        if self.highpatterns is not None:
+            return
+        lowpatterns, highpatterns, bases = self.sources
+        self.lowpatterns = { }
+        for pat in lowpatterns:
+            self.lowpatterns[comp_pattern(pat)] = lowpatterns[pat]
+        self.highpatterns = { }
+        for pat in highpatterns:
+            self.highpatterns[comp_pattern(pat)] = highpatterns[pat]
+        self.bases = [ ]
+        for name in bases:
+            bpat = '\\b' + name + '(?:\\s+(?:base|formula)\\b|\\b)'
+            self.bases.append(re.compile(
+                    '\\s*(?:\\(' + bpat + '\\)|(?:\\bin |[:,\\-]\\s*)' + bpat
+                            + '|' + bpat + '\\s*[\\-\\:,]?)\\s*',
+                    re.IGNORECASE))
+
+
+    def high_count( self ):
+        return len(self.sources[1])
+
+
+    def _compile_scent_first( self ):
+        """ Builds the table of high confidence patterns usable for scent-first
+            matching, as ( pattern, scent name, unique name ) tuples.  Simple
+            cream or soap patterns are left out.  Name uniqueness is only known
+            once every Sniffer exists, so this waits for findAnyScent().
+        """
+        self._compile()
+        table = [ ]
+        for pattern in self.highpatterns:
+            scent = self.highpatterns[pattern]
+            if (pattern.match('') or pattern.match('cream') or pattern.match('soap')
+                    or _simple_cream_soap_pat.match(scent)):
+                # simple cream/soap; not valid for scent-first match
+                # TODO uniqueness test
+                continue
+            table.append(( pattern, scent, _unique_names[scent] == 1 ))
+        self.scent_first = tuple(table)
 
 
     def strip_base( self, text: str ):
+        self._compile()
         if not self.bases:
             return text
         for pattern in self.bases:
@@ -134,7 +177,8 @@ class Sniffer:
 
     # can use low confidence patterns
     # return "Definitive Scent Name"
-    def match_on_maker( self, text: str ):
+    def match_on_maker( self, text: str, combined: bool = True ):
+        self._compile()
         text = text.strip()
         if not text and self.default_scent:
             result = _any_pattern.match(text)
@@ -146,6 +190,76 @@ class Sniffer:
                     'search': False
                 }
 
+        if not combined:
+            return self._match_serial(text)
+        # a successful match() is also what search() finds, so the high
+        # patterns only need searching
+        for pattern in self.highpatterns:
+            result = pattern.search(text)
+            if result:
+                return {
+                        'match': result,
+                        'maker': self.makername,
+                        'scent': self.highpatterns[pattern],
+                        'lather': None,
+                        'search': False
+                    }
+        result = self._match_low(text)
+        if result:
+            return {
+                    'match': result,
+                    'maker': self.makername,
+                    'scent': self.lowpatterns[result.re],
+                    'lather': None,
+                    'search': False
+                }
+        for pattern in self.lowpatterns:
+            result = pattern.search(text)
+            if result:
+                return {
+                        'match': result,
+                        'maker': self.makername,
+                        'scent': self.lowpatterns[pattern],
+                        'lather': None,
+                        'search': False
+                    }
+        return None
+
+
+    def precompile( self ):
+        """ Compiles the patterns and the low confidence alternation now,
+            rather than on first use.
+        """
+        self._compile()
+        if len(self.lowpatterns) >= 4:
+            if self.combined_low is None:
+                self.combined_low = OrderedAlternation(self.lowpatterns)
+            self.combined_low.compile_all()
+
+
+    def _match_low( self, text: str ):
+        """ Returns the first low confidence pattern's match at the start of
+            the text, or None.  With enough patterns, they are tried as one
+            alternation; otherwise calling each in turn is quicker.
+        """
+        if len(self.lowpatterns) < 4:
+            for pattern in self.lowpatterns:
+                result = pattern.match(text)
+                if result:
+                    return result
+            return None
+        if self.combined_low is None:
+            self.combined_low = OrderedAlternation(self.lowpatterns)
+        index = self.combined_low.match(text)
+        if index >= 0:
+            return self.combined_low.patterns[index].match(text)
+        return None
+
+
+    def _match_serial( self, text: str ):
+        """ The original pattern-by-pattern matching, kept to check the
+            combined patterns against (see check.py).
+        """
         for pattern in self.highpatterns:
             result = pattern.match(text)
             if not result:
@@ -2745,6 +2859,48 @@ def _compile_all():
             _add_unique(isonames)
 
 
+def _index_literals():
+    """ Builds each Sniffer's scent-first table, and indexes makers by the
+        literals their high confidence patterns require, for findAnyScent().
+        Makers with a pattern lacking a usable literal (three characters or
+        more) are always tried.  This compiles every Sniffer.
+    """
+    global _literal_makers, _unfiltered_makers, _literal_scanner
+    if _literal_scanner is not None:
+        return
+    _literal_makers = { }
+    _unfiltered_makers = set()
+    for maker in _compiled_pats:
+        so = _compiled_pats[maker]
+        if not isinstance(so, Sniffer):
+            continue
+        so._compile_scent_first()
+        maker_literals = set()
+        for pattern in so.highpatterns:
+            literals = required_literals(pattern)
+            if not literals or min(len(literal) for literal in literals) < 3:
+                _unfiltered_makers.add(maker)
+                break
+            maker_literals |= literals
+        else:
+            for literal in maker_literals:
+                if literal not in _literal_makers:
+                    _literal_makers[literal] = [ ]
+                _literal_makers[literal].append(maker)
+    _literal_scanner = LiteralScanner(_literal_makers)
+
+
+def precompile( ):
+    """ Compiles every pattern, table and alternation now, rather than on
+        first use.
+    """
+    _compile_all()
+    _index_literals()
+    for so in _compiled_pats.values():
+        if isinstance(so, Sniffer):
+            so.precompile()
+
+
 def _isUniqueScent( name: str ):
     if not _unique_names:
         raise Exception("_unique_names not complete!")
@@ -2757,7 +2913,28 @@ def match_scent( maker, scent ):
             'match': the result object from Pattern.match(), may be None
             'name': the standard scent name
         Otherwise None is returned.
+        Results are cached; each call gets its own copy of the dict.
     """
+    key = ( maker, scent )
+    cached = match_cache.get(key)
+    if cached is _no_match:
+        return None
+    if cached is not None:
+        return dict(cached)
+    result = _match_scent(maker, scent)
+    if result is None:
+        match_cache.put(key, _no_match)
+    else:
+        # read-only, so nothing can change the cached result
+        match_cache.put(key, MappingProxyType(dict(result)))
+    return result
+
+
+def match_cache_summary( ):
+    return match_cache.summary()
+
+
+def _match_scent( maker, scent ):
     _compile_all()
     if maker in _compiled_pats:
         so = _compiled_pats[maker]
@@ -2817,21 +2994,90 @@ def match_scent( maker, scent ):
     return so.custom(result)
 
 
-def findAnyScent( text ):
+def findAnyScent( text, prefilter: bool = True ):
+    """ Looks for any known scent in the text, whatever the maker.  With
+        prefilter, only makers whose patterns' literals are found in the text
+        are tried.
+    """
     _compile_all()
+    _index_literals()
+    candidates = None
+    if prefilter:
+        candidates = set(_unfiltered_makers)
+        for literal in _literal_scanner.scan(text):
+            candidates.update(_literal_makers[literal])
     best = None
     for maker in _compiled_pats:
         so = _compiled_pats[maker]
         if not isinstance(so, Sniffer):
             raise Exception(f"Maker '{maker}' is not Sniffer!")
-        result = _internal_find(text, maker, so.highpatterns, best)
+        if candidates is None or maker in candidates:
+            result = _internal_find(text, maker, so, best)
+        elif so.high_count() >= 2:
+            # nothing here can match, but the custom code still sees the best so far
+            result = best
+        else:
+            result = None
+        if result:
+            best = so.custom(result)
+
+    return best
+
+
+def _internal_find( text: str, maker: str, so: Sniffer, best: dict ):
+    if so.high_count() < 2:
+        # don't do single scents for now
+        return None
+    bestlen = 0
+    if best:
+        bestlen = best['match'].end() - best['match'].start()
+    for pattern, scent, is_unique in so.scent_first:
+        result = pattern.match(text)
+        if result and (not best
+                or result.start() < best['match'].start()
+                or (result.end() - result.start() > bestlen)):
+            bestlen = result.end() - result.start()
+            best = {
+                'match': result,
+                'scent': scent,
+                'maker': maker,
+                'lather': text,
+                'search': False
+            }
+        elif not best or (best and best['search']):
+            result = pattern.search(text)
+            if result and (not best
+                    or (is_unique and result.start() < best['match'].start())
+                    or (result.end() - result.start() > bestlen)):
+                bestlen = result.end() - result.start()
+                best = {
+                    'match': result,
+                    'scent': scent,
+                    'maker': maker,
+                    'lather': text,
+                    'search': True
+                }
+    return best
+
+
+def _findAnyScentSerial( text ):
+    """ The original findAnyScent(), checking every pattern's eligibility for
+        scent-first matching on each call, kept to check the scent-first
+        tables against (see check.py).
+    """
+    _compile_all()
+    best = None
+    for maker in _compiled_pats:
+        so = _compiled_pats[maker]
+        so._compile()
+        result = _internal_find_serial(text, maker, so.highpatterns, best)
         if result:
             best = so.custom(result)
 
     return best
 
 
-def _internal_find( text: str, maker: str, patterndict: dict, best: dict ):
+def _internal_find_serial( text: str, maker: str, patterndict: dict, best: dict ):
     if len(patterndict) < 2:
         # don't do single scents for now
         return None
@@ -2842,7 +3088,6 @@ def _internal_find( text: str, maker: str, patterndict: dict, best: dict ):
         if (pattern.match('') or pattern.match('cream') or pattern.match('soap')
                 or _simple_cream_soap_pat.match(patterndict[pattern])):
             # simple cream/soap; not valid for scent-first match
-            # TODO uniqueness test
             continue
         result = pattern.match(text)
         if result and (not best
@@ -2872,6 +3117,7 @@ def _internal_find( text: str, maker: str, patterndict: dict, best: dict ):
                 }
     return best
 
+
 def isSingleScent( maker ):
     """
     Indicates if only one single scent is known for this maker.
@@ -0,0 +1,58 @@
+-- SQLite version of schema.sql, used for the comment store (cache.CommentStore).
+-- Comments also keep the Reddit fields the file cache saves, so they load back
+-- unchanged; created_time and edited_time hold Reddit's created_utc and edited
+-- timestamps, as real so they read back exactly.
+
+create table if not exists full_text (
+    text_key integer primary key
+    , comment_id varchar(16) not null
+    , full_text text
+)
+;
+
+create table if not exists submission (
+    submission_id varchar(16) not null
+    , title varchar(255) not null
+    , permalink varchar(255) not null
+    , created_time datetime
+    , post_date date not null
+    , primary key (submission_id)
+)
+;
+
+create table if not exists comment (
+    comment_id varchar(16) not null
+    , created_time real not null
+    , edited_time real
+    , author_name varchar(255)
+    , parent_id varchar(16)
+    , score int
+    , permalink varchar(1024) not null
+    , submission_id varchar(16) not null
+    , plaintext_key int
+    , html_key int
+    , duplicate_comment_id varchar(16)
+    , link_id varchar(16)
+    , subreddit_id varchar(16)
+    , saved tinyint not null default 0
+    , primary key (comment_id)
+    , foreign key (plaintext_key) references full_text(text_key)
+    , foreign key (html_key) references full_text(text_key)
+    , foreign key (submission_id) references submission(submission_id)
+)
+;
+
+create table if not exists lather (
+    lather_key integer primary key
+    , comment_id varchar(16) not null
+    , maker varchar(255) not null
+    , scent varchar(255)
+    , confidence varchar(16) not null
+    , manual_ind tinyint not null default 0
+    , foreign key (comment_id) references comment(comment_id)
+)
+;
+
+create index if not exists submission_post_date on submission (post_date);
+create index if not exists comment_author_name on comment (author_name collate nocase);
+create index if not exists comment_submission_id on comment (submission_id);